@@ -7,8 +7,15 @@ import matplotlib.pyplot as plt
 import streamlit as st
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
-from src.utils import normalize_columns, dissolve_level
-from src.zonal_stats import compute_zonal_stats, attach_index
+from src.utils import normalize_columns, dissolve_level, file_fingerprint
+from src.zonal_stats import METRICS, compute_zonal_stats, compute_zonal_sufficient, sufficient_frame, attach_index
+from src.rollup import rollup_level
+from src.labels import CACHE_DIR
+from src.raster_cache import raster_content_hash, raster_meta
+from src.result_cache import ResultCache
+from src.uploads import store_upload
+from src.cog import ensure_cog, conversion_error, conversion_pending
+from src.store import read_results, write_results
 
 st.set_page_config(page_title="Peru Tmin — Zonal Stats", layout="wide")
 st.title("Peru Minimum Temperature (Tmin) — Zonal Statistics & Policy Explorer")
@@ -17,10 +24,20 @@ st.sidebar.header("Data")
 default_raster = "data/tmin_raster.tif" if os.path.exists("data/tmin_raster.tif") else None
 uploaded_raster = st.sidebar.file_uploader("Upload GeoTIFF (Tmin)", type=["tif","tiff"])
 raster_path = None
+raster_hash = None
 if uploaded_raster is not None:
-    raster_path = "data/_uploaded.tif"
-    with open(raster_path, "wb") as f:
-        f.write(uploaded_raster.read())
+    # Uploads are streamed into a content-addressed store, once per uploaded file and session.
+    upload_id = getattr(uploaded_raster, "file_id", None) or (uploaded_raster.name, uploaded_raster.size)
+    if st.session_state.get("upload_id") != upload_id or not os.path.exists(st.session_state.get("upload_path", "")):
+        st.session_state["upload_path"], st.session_state["upload_hash"] = store_upload(uploaded_raster)
+        st.session_state["upload_id"] = upload_id
+    raster_hash = st.session_state["upload_hash"]
+    # Reads switch to a tiled, overviewed COG copy once the background conversion has finished.
+    raster_path = ensure_cog(st.session_state["upload_path"])
+    if conversion_pending(st.session_state["upload_path"]):
+        st.sidebar.caption("Optimizing upload in the background (tiled COG); later reruns will use it.")
+    elif conversion_error(st.session_state["upload_path"]) is not None:
+        st.sidebar.caption("Could not optimize this upload (COG conversion failed); reading it as uploaded.")
 elif default_raster:
     raster_path = default_raster
 else:
@@ -32,27 +49,91 @@ if not os.path.exists(shape_path):
     st.error("Missing districts shapefile at data/DISTRITOS.shp")
     st.stop()
 
-gdf = gpd.read_file(shape_path).to_crs("EPSG:4326")
-gdf = normalize_columns(gdf)
+# Vector stages are shared read-only across reruns and sessions; keyed by the shapefile fingerprint (and level).
+@st.cache_resource(show_spinner=False)
+def load_districts(shape_path, shape_fp):
+    return normalize_columns(gpd.read_file(shape_path).to_crs("EPSG:4326"))
+
+@st.cache_resource(show_spinner=False)
+def load_level(shape_path, shape_fp, level):
+    gdf = load_districts(shape_path, shape_fp)
+    return gdf if level == "district" else dissolve_level(gdf, level)
+
+shape_fp = file_fingerprint(shape_path)
+gdf = load_districts(shape_path, shape_fp)
 
 level = st.sidebar.selectbox("Territorial level", ["district","province","department"], index=0)
 thr = st.sidebar.number_input("Threshold for custom metric (Tmin < X degC)", value=0.0, step=0.5, format="%.1f")
 band = st.sidebar.number_input("Raster band (1 = 2020, 2 = 2021, ...)", min_value=1, max_value=60, value=1, step=1)
 
-if level != "district":
-    gdf_lvl = dissolve_level(gdf, level)
-else:
-    gdf_lvl = gdf.copy()
+gdf_lvl = load_level(shape_path, shape_fp, level)
 
 st.sidebar.header("Filters")
 min_pixels = st.sidebar.number_input("Min pixel count (quality filter)", value=10, step=1, min_value=0)
 
-with st.spinner("Computing zonal statistics..."):
-    zs = compute_zonal_stats(gdf_lvl, raster_path, band=int(band), threshold=float(thr))
-    out = attach_index(gdf_lvl, zs, level=level)
-    out = out[out["count"] >= min_pixels]
+@st.cache_data(show_spinner=False, max_entries=4)
+def district_sufficient(_gdf, shape_fp, _raster_path, raster_hash):
+    # One district-level pass over all bands; provinces and departments are rolled up from it,
+    # and any band or threshold is answered from its sums and histograms.
+    # Keyed by content hash, not path: switching reads to the upload's COG copy reuses the pass.
+    return compute_zonal_sufficient(_gdf, _raster_path, decoded_cache=CACHE_DIR)
+
+@st.cache_resource
+def result_cache():
+    # Finalized stats per (raster, shapefile, level, band, threshold), shared by all sessions, LRU under 256 MB.
+    return ResultCache(max_bytes=256 * 1024 * 1024)
+
+@st.cache_resource
+def full_ready():
+    # (raster, shapefile) pairs whose district pass is already cached; others get a preview first.
+    return set()
+
+n_bands = raster_meta(raster_path)["count"]
+if int(band) > n_bands:
+    st.error(f"Band {band} not found; the raster has {n_bands} band(s).")
+    st.stop()
 
-st.success(f"Computed stats for {len(out)} {level}s on band {band}.")
+# Metrics the page displays (quality filter, histogram/map/rankings, risk score): all the overview preview computes.
+# The full-resolution tables keep every metric (min/max/std come free from the sufficient statistics) for the CSV
+# download and the store.
+VIEW_METRICS = ["count", "mean", "percentile_10", "percentile_90"]
+
+raster_hash = raster_hash or raster_content_hash(raster_path)
+key = (raster_hash, shape_fp, level, int(band), float(thr))
+pass_key = (raster_hash, shape_fp)
+cached = result_cache().get(key)
+is_preview = False
+if cached is None and pass_key not in full_ready():
+    # First paint from an overview; the full-resolution district pass runs at the end of the script, then the page
+    # reruns.
+    with st.spinner("Computing preview statistics..."):
+        zs = compute_zonal_stats(gdf_lvl, raster_path, band=int(band), threshold=float(thr), backend="label",
+                                 preview=True, metrics=VIEW_METRICS)
+        cached = attach_index(gdf_lvl, zs, level=level)
+    is_preview = True
+elif cached is None:
+    # Full-resolution results (percentiles from 0.05 degC histograms) persist in the Parquet store, keyed by raster
+    # and shapefile, so fresh processes and notebooks reuse them.
+    cached = read_results(raster_hash, shape_fp, level, int(band), float(thr))
+    if cached is not None and not set(METRICS) <= set(cached.columns):
+        cached = None  # stored by a build that trimmed the tables to VIEW_METRICS
+    if cached is None:
+        with st.spinner("Computing zonal statistics..."):
+            suff = district_sufficient(gdf, shape_fp, raster_path, raster_hash)
+            meta, suff_lvl = rollup_level(gdf, suff, level)
+            stats = sufficient_frame(suff_lvl, int(band), threshold=float(thr))
+            cached = attach_index(meta, stats, level=level)
+            write_results(cached, raster_hash, shape_fp, level, int(band), float(thr))
+    result_cache().put(key, cached)
+
+# min_pixels is a pure post-filter on the cached result.
+out = cached[cached["count"] >= min_pixels].copy()
+
+if is_preview:
+    st.info(f"Preview for {len(out)} {level}s on band {band} (overview resolution, median mean error "
+            f"±{out['mean_error'].median():.2f} degC); full-resolution statistics are being computed.")
+else:
+    st.success(f"Computed stats for {len(out)} {level}s on band {band}.")
 
 # Derived risk score example
 out["risk_score"] = (100 - out["percentile_10"]).rank(pct=True) * 0.6 + out["below_threshold_pct"].rank(pct=True) * 0.4
@@ -274,4 +355,10 @@ Requiere:
 - ✅ Línea base: Obtener data de SENAMHI de frecuencia e intensidad de friajes + data MINSA/MINEDU de impacto
 """)
 
-st.caption("Built with GeoPandas, rasterstats, rioxarray, and Streamlit.")
\ No newline at end of file
+st.caption("Built with GeoPandas, rasterstats, rioxarray, and Streamlit.")
+
+if is_preview:
+    with st.spinner("Computing full-resolution statistics..."):
+        district_sufficient(gdf, shape_fp, raster_path, raster_hash)
+    full_ready().add(pass_key)
+    st.rerun()
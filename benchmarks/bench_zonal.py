@@ -0,0 +1,72 @@
+from __future__ import annotations
+import argparse
+import os
+import sys
+import time
+import numpy as np
+import geopandas as gpd
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from rasterstats import zonal_stats
+from src import kernels
+from src.labels import zone_labels
+from src.raster_cache import open_raster
+from src.utils import normalize_columns
+from src.zonal_stats import METRICS, compute_zonal_stats
+
+def best_of(fn, repeat: int) -> float:
+    # Fastest wall time (s) of `repeat` runs after one warm-up (label cache, JIT compilation, file cache).
+    fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+def rasterstats_baseline(gdf: gpd.GeoDataFrame, raster_path: str, band: int, threshold: float) -> None:
+    # The original engine: a rasterstats pass for METRICS and a raster_out pass for below_threshold_pct.
+    zonal_stats(gdf["geometry"], raster_path, band=band, nodata=np.nan, stats=METRICS, all_touched=False)
+    for r in zonal_stats(gdf["geometry"], raster_path, band=band, nodata=np.nan, stats=None, raster_out=True,
+                         all_touched=False):
+        arr = r.get("mini_raster_array")
+        if arr is not None:
+            data = arr.compressed() if np.ma.isMaskedArray(arr) else arr.ravel()
+            data = data[~np.isnan(data)]
+            float((data < threshold).sum()) / max(data.size, 1)
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description="Zonal stats timings against the rasterstats baseline.")
+    ap.add_argument("--raster", default="data/tmin_raster.tif")
+    ap.add_argument("--zones", default="data/DISTRITOS.shp")
+    ap.add_argument("--band", type=int, default=1)
+    ap.add_argument("--threshold", type=float, default=0.0)
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    gdf = normalize_columns(gpd.read_file(args.zones))
+    with open_raster(args.raster) as src:
+        gdf = gdf.to_crs(src.crs) if gdf.crs is not None and src.crs is not None else gdf
+        arr = src.read(args.band)
+        labels = zone_labels(gdf, src.transform, (src.height, src.width), crs=src.crs)
+        nodata = src.nodata
+
+    runs = {"rasterstats (2 passes)": lambda: rasterstats_baseline(gdf, args.raster, args.band, args.threshold)}
+    for backend in ("window", "label", "sparse"):
+        runs[f"compute_zonal_stats[{backend}]"] = (
+            lambda b=backend: compute_zonal_stats(gdf, args.raster, args.band, args.threshold, backend=b))
+    engines = [e for e in kernels.ENGINES if e != "numba" or kernels.numba is not None]
+    for engine in engines:
+        runs[f"zone_moments[{engine}]"] = (
+            lambda e=engine: kernels.zone_moments(arr, labels, len(gdf), nodata, [args.threshold], engine=e))
+
+    base = None
+    print(f"{len(gdf)} zones, {arr.shape[0]}x{arr.shape[1]} pixels, band {args.band}, best of {args.repeat}")
+    for name, fn in runs.items():
+        t = best_of(fn, args.repeat)
+        base = base or t
+        print(f"{name:32s} {t * 1000:10.1f} ms {base / t:8.1f}x")
+    if kernels.numba is None:
+        print("numba is not installed: zone_moments uses the NumPy engine")
+
+if __name__ == "__main__":
+    main()
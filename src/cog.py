@@ -0,0 +1,82 @@
+from __future__ import annotations
+import os
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future
+import rasterio
+import rasterio.shutil
+from rasterio.enums import Resampling
+from src.raster_cache import POOL
+
+BLOCKSIZE = 256
+OVERVIEW_LEVELS = [2, 4, 8, 16]
+
+# One background converter per process; conversions are started at most once per source file, and a file whose
+# conversion failed is read as is from then on (the error is logged once and kept in _FAILED).
+_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cog")
+_JOBS: dict[str, Future] = {}
+_FAILED: dict[str, BaseException] = {}
+_LOCK = threading.Lock()
+log = logging.getLogger(__name__)
+
+def cog_path_for(raster_path: str) -> str:
+    stem, _ = os.path.splitext(raster_path)
+    return stem + ".cog.tif"
+
+def is_optimized(raster_path: str) -> bool:
+    # Tiled, compressed and with overviews: window reads and previews need no further conversion.
+    with POOL.borrow(raster_path) as src:
+        return src.profile.get("tiled", False) and src.compression is not None and bool(src.overviews(1))
+
+def convert_to_cog(raster_path: str, dst_path: str | None = None) -> str:
+    # Write an internally tiled, deflate-compressed Cloud-Optimized GeoTIFF with averaged overviews.
+    dst_path = dst_path or cog_path_for(raster_path)
+    tmp = dst_path + f".{os.getpid()}.tmp.tif"
+    try:
+        with rasterio.Env() as env:
+            if "COG" in env.drivers():
+                rasterio.shutil.copy(raster_path, tmp, driver="COG", COMPRESS="DEFLATE", PREDICTOR="YES",
+                                     BLOCKSIZE=BLOCKSIZE, OVERVIEW_RESAMPLING="AVERAGE", BIGTIFF="IF_SAFER")
+            else:
+                rasterio.shutil.copy(raster_path, tmp, driver="GTiff", TILED="YES", COMPRESS="DEFLATE",
+                                     BLOCKXSIZE=BLOCKSIZE, BLOCKYSIZE=BLOCKSIZE, BIGTIFF="IF_SAFER")
+                with rasterio.open(tmp, "r+") as dst:
+                    dst.build_overviews(OVERVIEW_LEVELS, Resampling.average)
+                    dst.update_tags(ns="rio_overview", resampling="average")
+        os.replace(tmp, dst_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return dst_path
+
+def ensure_cog(raster_path: str) -> str:
+    # Path to read from: the optimized copy once it exists, otherwise the original while a background
+    # conversion runs (started on first call). Already-optimized rasters are returned unchanged.
+    dst = cog_path_for(raster_path)
+    if os.path.exists(dst) and os.path.getmtime(dst) >= os.path.getmtime(raster_path):
+        return dst
+    with _LOCK:
+        if raster_path in _FAILED:
+            return raster_path
+        job = _JOBS.get(raster_path)
+        if job is None:
+            if is_optimized(raster_path):
+                return raster_path
+            _JOBS[raster_path] = _EXECUTOR.submit(convert_to_cog, raster_path, dst)
+        elif job.done():
+            _JOBS.pop(raster_path)
+            if job.exception() is None:
+                return job.result()
+            _FAILED[raster_path] = job.exception()
+            log.warning("COG conversion of %s failed; reading the original: %s", raster_path, job.exception())
+    return raster_path
+
+def conversion_error(raster_path: str) -> BaseException | None:
+    # Why the COG conversion of `raster_path` failed, or None (not failed, or still running).
+    with _LOCK:
+        return _FAILED.get(raster_path)
+
+def conversion_pending(raster_path: str) -> bool:
+    with _LOCK:
+        job = _JOBS.get(raster_path)
+        return job is not None and not job.done()
@@ -0,0 +1,67 @@
+from __future__ import annotations
+import numpy as np
+
+# Fixed Tmin bin grid (degC) shared by every zone, band and level, so histograms merge by plain summation.
+BIN_LO = -30.0
+BIN_HI = 40.0
+BIN_WIDTH = 0.05
+
+def n_bins(lo: float = BIN_LO, hi: float = BIN_HI, width: float = BIN_WIDTH) -> int:
+    return int(round((hi - lo) / width))
+
+def bin_edges(lo: float = BIN_LO, hi: float = BIN_HI, width: float = BIN_WIDTH) -> np.ndarray:
+    return lo + width * np.arange(n_bins(lo, hi, width) + 1)
+
+def zone_histograms(vals: np.ndarray, lab: np.ndarray, n_zones: int, lo: float = BIN_LO, hi: float = BIN_HI,
+                    width: float = BIN_WIDTH) -> np.ndarray:
+    # Per-zone pixel counts on the fixed grid (n_zones x n_bins); values outside [lo, hi) land in the end bins.
+    nb = n_bins(lo, hi, width)
+    b = np.clip(np.floor((vals - lo) / width), 0, nb - 1).astype(np.int64)
+    hist = np.bincount(lab * nb + b, minlength=n_zones * nb).reshape(n_zones, nb)
+    return hist.astype(np.uint32)
+
+def merge_histograms(hist: np.ndarray, groups) -> tuple[np.ndarray, np.ndarray]:
+    # Sum zone histograms (first axis) by group key, e.g. districts into provinces; returns (keys, merged).
+    keys, inv = np.unique(np.asarray(groups), return_inverse=True)
+    order = np.argsort(inv, kind="stable")
+    starts = np.searchsorted(inv[order], np.arange(keys.size))
+    return keys, np.add.reduceat(hist[order].astype(np.uint64), starts, axis=0)
+
+def _order_statistic(hist: np.ndarray, cum: np.ndarray, k: np.ndarray, lo: float, width: float) -> np.ndarray:
+    # Approximate k-th smallest value (0-based) per zone, placing a bin's pixels evenly across its width.
+    rows = np.arange(hist.shape[0])
+    b = np.minimum((cum <= k[:, None]).sum(axis=1), hist.shape[1] - 1)
+    before = cum[rows, b] - hist[rows, b]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return lo + width * (b + (k - before + 0.5) / hist[rows, b])
+
+def hist_percentile(hist: np.ndarray, q, lo: float = BIN_LO, width: float = BIN_WIDTH) -> np.ndarray:
+    # Percentile(s) per zone (n_zones x len(q)) with np.percentile's linear rule; error <= one bin width.
+    hist = np.atleast_2d(hist).astype(np.float64)
+    q = np.atleast_1d(np.asarray(q, dtype=float))
+    cum = np.cumsum(hist, axis=1)
+    has = cum[:, -1] > 0
+    out = np.full((hist.shape[0], q.size), np.nan)
+    # Empty zones stay NaN; only non-empty rows are interpolated (no 0/0 or inf - inf on them).
+    hist, cum = hist[has], cum[has]
+    total = cum[:, -1]
+    for j, qq in enumerate(q):
+        rank = (total - 1) * qq / 100.0
+        k_lo = np.floor(rank)
+        v_lo = _order_statistic(hist, cum, k_lo, lo, width)
+        v_hi = _order_statistic(hist, cum, np.minimum(k_lo + 1, total - 1), lo, width)
+        out[has, j] = v_lo + (v_hi - v_lo) * (rank - k_lo)
+    return out
+
+def hist_below_pct(hist: np.ndarray, threshold: float, lo: float = BIN_LO, width: float = BIN_WIDTH) -> np.ndarray:
+    # Percent of pixels below `threshold` per zone; exact when the threshold falls on a bin edge.
+    hist = np.atleast_2d(hist).astype(np.float64)
+    nb = hist.shape[1]
+    pos = np.clip(np.round((threshold - lo) / width, 9), 0, nb)
+    full = int(np.floor(pos))
+    below = hist[:, :full].sum(axis=1)
+    if full < nb:
+        below += (pos - full) * hist[:, full]
+    total = hist.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, below / total * 100.0, np.nan)
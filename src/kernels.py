@@ -0,0 +1,85 @@
+from __future__ import annotations
+import numpy as np
+
+# Optional compiled kernels: Numba when installed, otherwise the NumPy path below (same results).
+try:
+    import numba
+except ImportError:
+    numba = None
+
+ENGINES = ("numba", "numpy")
+DEFAULT_ENGINE = "numba" if numba is not None else "numpy"
+
+def _moments_numpy(arr: np.ndarray, labels: np.ndarray, n_zones: int, nodata, thresholds: np.ndarray) -> tuple:
+    # Reference path: mask, then one bincount per accumulator and ufunc.at for min/max.
+    valid = labels > 0
+    if nodata is not None:
+        valid &= arr != nodata
+    if np.issubdtype(arr.dtype, np.floating):
+        valid &= ~np.isnan(arr)
+    lab = labels[valid].astype(np.int64) - 1
+    vals = arr[valid].astype(float)
+    vmin = np.full(n_zones, np.inf)
+    vmax = np.full(n_zones, -np.inf)
+    np.minimum.at(vmin, lab, vals)
+    np.maximum.at(vmax, lab, vals)
+    k = thresholds.size
+    idx = np.searchsorted(thresholds, vals, side="right")
+    hist = np.bincount(lab * (k + 1) + idx, minlength=n_zones * (k + 1)).reshape(n_zones, k + 1)
+    return (np.bincount(lab, minlength=n_zones), np.bincount(lab, weights=vals, minlength=n_zones),
+            np.bincount(lab, weights=vals * vals, minlength=n_zones), vmin, vmax, np.cumsum(hist, axis=1)[:, :k])
+
+if numba is not None:
+    @numba.njit(cache=True, nogil=True)
+    def _moments_loop(arr, labels, n_zones, nodata, check_nodata, thresholds):
+        # One pass over the pixels: validity, count, sum, sum of squares, min, max and below-threshold counts.
+        k = thresholds.size
+        count = np.zeros(n_zones, dtype=np.int64)
+        total = np.zeros(n_zones)
+        sumsq = np.zeros(n_zones)
+        vmin = np.full(n_zones, np.inf)
+        vmax = np.full(n_zones, -np.inf)
+        below = np.zeros((n_zones, k), dtype=np.int64)
+        for p in range(arr.size):
+            z = labels[p] - 1
+            if z < 0:
+                continue
+            v = arr[p]
+            if v != v or (check_nodata and v == nodata):
+                continue
+            x = np.float64(v)
+            count[z] += 1
+            total[z] += x
+            sumsq[z] += x * x
+            if x < vmin[z]:
+                vmin[z] = x
+            if x > vmax[z]:
+                vmax[z] = x
+            for j in range(k):
+                if x < thresholds[j]:
+                    below[z, j] += 1
+        return count, total, sumsq, vmin, vmax, below
+
+def zone_moments(arr: np.ndarray, labels: np.ndarray, n_zones: int, nodata=None, thresholds=(),
+                 engine: str | None = None) -> dict:
+    # count, sum, sumsq, min, max (inf/-inf for empty zones) and `below` (n_zones x len(thresholds), pixels
+    # strictly below each threshold) of every zone of a label grid, straight from the band.
+    # engine=None picks Numba's fused single loop when available, else the NumPy passes.
+    engine = engine or DEFAULT_ENGINE
+    if engine not in ENGINES:
+        raise ValueError("engine must be one of: " + ", ".join(ENGINES))
+    if engine == "numba" and numba is None:
+        raise ValueError("engine='numba' needs the numba package")
+    t = np.asarray(thresholds, dtype=float).ravel()
+    order = np.argsort(t)
+    if nodata is not None:
+        # Compare in the band dtype: -9999.9 must match the float32 pixels that store it, in both engines.
+        nodata = float(arr.dtype.type(nodata))
+    if engine == "numba":
+        out = _moments_loop(np.ascontiguousarray(arr).ravel(), np.ascontiguousarray(labels).ravel(), n_zones,
+                            0.0 if nodata is None else nodata, nodata is not None, t[order])
+    else:
+        out = _moments_numpy(arr, labels, n_zones, nodata, t[order])
+    below = np.empty_like(out[5])
+    below[:, order] = out[5]
+    return dict(zip(("count", "sum", "sumsq", "min", "max"), out[:5]), below=below)
@@ -0,0 +1,185 @@
+from __future__ import annotations
+import os
+import json
+import math
+import hashlib
+import numpy as np
+import geopandas as gpd
+import shapely
+from scipy import sparse
+from affine import Affine
+from rasterio.features import geometry_mask, rasterize
+from src.utils import write_atomic
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "_cache")
+
+def rasterize_zones(vector: gpd.GeoDataFrame, transform, shape: tuple, all_touched: bool = False) -> np.ndarray:
+    # Burn every polygon into one int32 label grid aligned to the raster: 0 = no zone, i + 1 = row i of `vector`.
+    # Zones are burned in row order, so where polygons overlap the later row owns the pixel.
+    shapes = [(geom, i + 1) for i, geom in enumerate(vector["geometry"]) if geom is not None and not geom.is_empty]
+    if not shapes:
+        return np.zeros(shape, dtype="int32")
+    return rasterize(shapes, out_shape=shape, transform=transform, fill=0, dtype="int32", all_touched=all_touched)
+
+def zones_fingerprint(vector: gpd.GeoDataFrame) -> str:
+    # Hash of the zone geometries (WKB, in row order) and their CRS.
+    h = hashlib.sha256()
+    h.update(str(vector.crs.to_wkt() if vector.crs is not None else "").encode())
+    for wkb in shapely.to_wkb(np.asarray(vector["geometry"].values), hex=False):
+        b = wkb or b""
+        h.update(len(b).to_bytes(8, "little"))
+        h.update(b)
+    return h.hexdigest()
+
+def label_cache_key(vector: gpd.GeoDataFrame, transform, shape: tuple, crs, all_touched: bool = False) -> str:
+    # Cache key: zone geometries + raster grid (transform, shape, CRS) + rasterization rule.
+    grid = json.dumps({
+        "transform": list(transform)[:6],
+        "shape": list(shape),
+        "crs": crs.to_wkt() if crs is not None else None,
+        "all_touched": bool(all_touched),
+    }, sort_keys=True)
+    return hashlib.sha256((zones_fingerprint(vector) + grid).encode()).hexdigest()[:32]
+
+def zone_labels(vector: gpd.GeoDataFrame, transform, shape: tuple, crs=None, all_touched: bool = False,
+                cache_dir: str | None = CACHE_DIR) -> np.ndarray:
+    # Label grid for `vector` on the raster grid, loaded from the on-disk cache when available.
+    # Cache entries are a compressed .npz plus a small .json manifest; cache_dir=None disables caching.
+    if cache_dir is None:
+        return rasterize_zones(vector, transform, shape, all_touched=all_touched)
+    key = label_cache_key(vector, transform, shape, crs, all_touched=all_touched)
+    folder = os.path.join(cache_dir, "labels")
+    npz_path = os.path.join(folder, key + ".npz")
+    manifest_path = os.path.join(folder, key + ".json")
+    if os.path.exists(npz_path) and os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("shape") == list(shape) and manifest.get("n_zones") == len(vector):
+            with np.load(npz_path) as z:
+                return z["labels"]
+
+    labels = rasterize_zones(vector, transform, shape, all_touched=all_touched)
+    os.makedirs(folder, exist_ok=True)
+    write_atomic(npz_path, lambda f: np.savez_compressed(f, labels=labels))
+    manifest = {
+        "key": key,
+        "n_zones": len(vector),
+        "shape": list(shape),
+        "transform": list(transform)[:6],
+        "crs": crs.to_string() if crs is not None else None,
+        "all_touched": bool(all_touched),
+        "dtype": str(labels.dtype),
+    }
+    write_atomic(manifest_path, lambda f: f.write(json.dumps(manifest, indent=2).encode()))
+    return labels
+
+def labels_to_matrix(labels: np.ndarray, n_zones: int) -> sparse.csr_matrix:
+    # Zone x pixel CSR membership matrix of a label grid: row i has a 1.0 at every (flattened) pixel of zone i.
+    flat = labels.ravel()
+    pix = np.flatnonzero(flat)
+    return sparse.csr_matrix((np.ones(pix.size), (flat[pix].astype(np.int64) - 1, pix)),
+                             shape=(n_zones, flat.size))
+
+def _cell_boxes(rows: np.ndarray, cols: np.ndarray, transform) -> np.ndarray:
+    # Footprints of raster cells (row, col) as shapely boxes (north-up grids).
+    x0, y0 = transform.c + cols * transform.a, transform.f + rows * transform.e
+    x1, y1 = x0 + transform.a, y0 + transform.e
+    return shapely.box(np.minimum(x0, x1), np.minimum(y0, y1), np.maximum(x0, x1), np.maximum(y0, y1))
+
+def _zone_windows(vector: gpd.GeoDataFrame, transform, shape: tuple):
+    # (row, geometry, row offset, col offset, window shape, window transform) of every zone overlapping the grid.
+    height, width = shape
+    inv = ~transform
+    for i, geom in enumerate(vector["geometry"]):
+        if geom is None or geom.is_empty:
+            continue
+        w, s, e, n = geom.bounds
+        (ca, ra), (cb, rb) = inv * (w, n), inv * (e, s)
+        r0, r1 = max(int(math.floor(min(ra, rb))), 0), min(int(math.ceil(max(ra, rb))), height)
+        c0, c1 = max(int(math.floor(min(ca, cb))), 0), min(int(math.ceil(max(ca, cb))), width)
+        if r1 <= r0 or c1 <= c0:
+            continue
+        yield i, geom, r0, c0, (r1 - r0, c1 - c0), transform * Affine.translation(c0, r0)
+
+def _csr(rows: list, cols: list, vals: list, n_zones: int, shape: tuple) -> sparse.csr_matrix:
+    # Zone x pixel CSR matrix from per-zone (row, flat pixel, value) chunks.
+    if not rows:
+        return sparse.csr_matrix((n_zones, shape[0] * shape[1]))
+    return sparse.csr_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                             shape=(n_zones, shape[0] * shape[1]))
+
+def coverage_fractions(vector: gpd.GeoDataFrame, transform, shape: tuple) -> sparse.csr_matrix:
+    # Exact share of each pixel's area covered by each zone, as a zone x pixel CSR matrix (0 < weight <= 1).
+    # Cells not crossed by the zone boundary get 1.0; only boundary cells are intersected with the polygon.
+    px_area = abs(transform.a * transform.e)
+    rows, cols, vals = [], [], []
+    for i, geom, r0, c0, win_shape, win_transform in _zone_windows(vector, transform, shape):
+        touched = geometry_mask([geom], out_shape=win_shape, transform=win_transform, invert=True, all_touched=True)
+        edge = geometry_mask([geom.boundary], out_shape=win_shape, transform=win_transform, invert=True,
+                             all_touched=True)
+        rr, cc = np.nonzero(touched | edge)
+        frac = np.ones(rr.size)
+        on_edge = edge[rr, cc]
+        boxes = _cell_boxes(rr[on_edge] + r0, cc[on_edge] + c0, transform)
+        frac[on_edge] = np.clip(shapely.area(shapely.intersection(boxes, geom)) / px_area, 0.0, 1.0)
+        keep = frac > 0
+        rows.append(np.full(int(keep.sum()), i, dtype=np.int64))
+        cols.append((rr[keep] + r0).astype(np.int64) * shape[1] + cc[keep] + c0)
+        vals.append(frac[keep])
+    return _csr(rows, cols, vals, len(vector), shape)
+
+# Entries of a boundary-class matrix: the cell centre is inside the zone, or the zone only touches the cell.
+CENTRE, EDGE_ONLY = 1.0, 2.0
+
+def boundary_classes(vector: gpd.GeoDataFrame, transform, shape: tuple) -> sparse.csr_matrix:
+    # Zone x pixel CSR matrix of every all_touched cell, valued CENTRE or EDGE_ONLY (same pixel rules as
+    # rasterize), so both the centre-point and the all_touched pixel sets of a zone come from one classification.
+    rows, cols, vals = [], [], []
+    for i, geom, r0, c0, win_shape, win_transform in _zone_windows(vector, transform, shape):
+        touched = geometry_mask([geom], out_shape=win_shape, transform=win_transform, invert=True, all_touched=True)
+        centre = geometry_mask([geom], out_shape=win_shape, transform=win_transform, invert=True, all_touched=False)
+        rr, cc = np.nonzero(touched | centre)
+        rows.append(np.full(rr.size, i, dtype=np.int64))
+        cols.append((rr + r0).astype(np.int64) * shape[1] + cc + c0)
+        vals.append(np.where(centre[rr, cc], CENTRE, EDGE_ONLY))
+    return _csr(rows, cols, vals, len(vector), shape)
+
+MATRIX_KINDS = ("labels", "coverage", "boundary")
+
+def zone_matrix(vector: gpd.GeoDataFrame, transform, shape: tuple, crs=None, all_touched: bool = False,
+                cache_dir: str | None = CACHE_DIR, kind: str = "labels") -> sparse.csr_matrix:
+    # Sparse zone x pixel matrix for `vector` on the raster grid, built once and cached next to the label grid
+    # (same key) as a scipy .npz; cache_dir=None disables caching.
+    # kind="labels": 0/1 membership from the label grid; "coverage": exact fractional weights (coverage_fractions);
+    # "boundary": centre-point / edge-only classes of the all_touched cells (boundary_classes).
+    # kind="labels" with all_touched=True is every touched cell of the boundary matrix set to 1.0: a label grid
+    # would give a pixel shared by adjacent zones to only one of them.
+    if kind not in MATRIX_KINDS:
+        raise ValueError("kind must be one of: " + ", ".join(MATRIX_KINDS))
+    if kind == "labels" and all_touched:
+        matrix = zone_matrix(vector, transform, shape, crs=crs, cache_dir=cache_dir, kind="boundary").copy()
+        matrix.data[:] = 1.0
+        return matrix
+
+    def build() -> sparse.csr_matrix:
+        if kind == "coverage":
+            return coverage_fractions(vector, transform, shape)
+        if kind == "boundary":
+            return boundary_classes(vector, transform, shape)
+        labels = zone_labels(vector, transform, shape, crs=crs, all_touched=all_touched, cache_dir=cache_dir)
+        return labels_to_matrix(labels, len(vector))
+
+    if cache_dir is None:
+        return build()
+    key = label_cache_key(vector, transform, shape, crs, all_touched=all_touched or kind != "labels")
+    folder = os.path.join(cache_dir, "matrices")
+    npz_path = os.path.join(folder, key + ("" if kind == "labels" else "-" + kind) + ".npz")
+    if os.path.exists(npz_path):
+        matrix = sparse.load_npz(npz_path).tocsr()
+        if matrix.shape == (len(vector), shape[0] * shape[1]):
+            return matrix
+
+    matrix = build()
+    os.makedirs(folder, exist_ok=True)
+    write_atomic(npz_path, lambda f: sparse.save_npz(f, matrix))
+    return matrix
@@ -0,0 +1,144 @@
+from __future__ import annotations
+import numpy as np
+from src import histogram
+
+# Per-zone accumulators a metric can ask for. Each is computed at most once per band, whatever the number of
+# metrics reading it: count, sum, sumsq, below (pixels under each threshold, n_zones x K), hist (fixed-grid
+# histogram, see src.histogram) and sorted ((zone, value)-sorted values and segment starts).
+ACCUMULATORS = ("count", "sum", "sumsq", "below", "hist", "sorted")
+
+def threshold_column(threshold: float) -> str:
+    # Column name of one threshold of a sweep, e.g. below_threshold_pct_-2.5.
+    return f"below_threshold_pct_{float(threshold):g}"
+
+def _threshold_columns(threshold) -> list[tuple[str, float | None]]:
+    # (column, threshold) pairs: None or a scalar gives the single below_threshold_pct column, a sequence gives a sweep.
+    if threshold is None or np.isscalar(threshold):
+        return [("below_threshold_pct", None if threshold is None else float(threshold))]
+    return [(threshold_column(t), float(t)) for t in threshold]
+
+def _below_threshold_counts(vals: np.ndarray, lab: np.ndarray, n_zones: int, thresholds: list[float]) -> np.ndarray:
+    # Pixels strictly below each threshold, per zone (n_zones x K), from one digitize + bincount and a cumulative sum.
+    t = np.asarray(thresholds, dtype=float)
+    order = np.argsort(t)
+    k = t.size
+    idx = np.searchsorted(t[order], vals, side="right")
+    hist = np.bincount(lab * (k + 1) + idx, minlength=n_zones * (k + 1)).reshape(n_zones, k + 1)
+    cum = np.cumsum(hist, axis=1)[:, :k]
+    out = np.empty_like(cum)
+    out[:, order] = cum
+    return out
+
+class Metric:
+    # A registered zone metric. `needs` names ACCUMULATORS, `terms` maps names to per-pixel functions whose
+    # per-zone sums land in acc["terms"], and finalize(acc, threshold) returns {column: per-zone values}.
+    # default=True metrics are always computed (below_threshold_pct); others only when named in metrics=.
+    # extensive=True marks sums over pixels (they grow with zone area, like count): previews scale the metric's
+    # column (named after the metric) back to full resolution.
+
+    def __init__(self, name: str, finalize, needs=(), terms=None, default: bool = False, extensive: bool = False):
+        unknown = set(needs) - set(ACCUMULATORS)
+        if unknown:
+            raise ValueError(f"unknown accumulator(s) {sorted(unknown)}; expected {', '.join(ACCUMULATORS)}")
+        self.name = name
+        self.finalize = finalize
+        self.needs = tuple(needs)
+        self.terms = dict(terms or {})
+        self.default = default
+        self.extensive = extensive
+
+REGISTRY = {}
+
+def register(name: str, needs=(), terms=None, default: bool = False, extensive: bool = False):
+    # Decorator adding finalize(acc, threshold) to REGISTRY as metric `name`.
+    def wrap(finalize):
+        REGISTRY[name] = Metric(name, finalize, needs=needs, terms=terms, default=default, extensive=extensive)
+        return finalize
+    return wrap
+
+def resolve(names=None) -> list[Metric]:
+    # Default metrics plus the registered ones named in `names`, in registration order.
+    names = set(names or ())
+    return [m for m in REGISTRY.values() if m.default or m.name in names]
+
+def requirements(metrics: list[Metric]) -> tuple[set, dict]:
+    # Union of the accumulators and per-pixel terms needed by `metrics`.
+    needs, terms = set(), {}
+    for m in metrics:
+        needs.update(m.needs)
+        terms.update(m.terms)
+    return needs, terms
+
+def accumulate(lab: np.ndarray, vals: np.ndarray, n_zones: int, needs, terms=None, thresholds=(),
+               acc: dict | None = None) -> dict:
+    # One pass of every needed accumulator over a band's (zone, value) pixels. Entries already in `acc`
+    # (e.g. count/sum/sumsq/below from src.kernels) are reused, not recomputed.
+    acc = dict(acc or {})
+    needs = set(needs)
+    if needs & {"count", "sorted"} and "count" not in acc:
+        acc["count"] = np.bincount(lab, minlength=n_zones)
+    if "sum" in needs and "sum" not in acc:
+        acc["sum"] = np.bincount(lab, weights=vals, minlength=n_zones)
+    if "sumsq" in needs and "sumsq" not in acc:
+        acc["sumsq"] = np.bincount(lab, weights=vals * vals, minlength=n_zones)
+    if "below" in needs and "below" not in acc:
+        t = list(thresholds)
+        acc["below"] = _below_threshold_counts(vals, lab, n_zones, t) if t else np.zeros((n_zones, 0), dtype=np.int64)
+    if "hist" in needs and "hist" not in acc:
+        acc["hist"] = histogram.zone_histograms(vals, lab, n_zones)
+    if "sorted" in needs and "sorted" not in acc:
+        order = np.lexsort((vals, lab))
+        acc["sorted"] = (vals[order], np.cumsum(acc["count"]) - acc["count"])
+    if terms:
+        acc.setdefault("terms", {})
+        for name, fn in terms.items():
+            if name not in acc["terms"]:
+                acc["terms"][name] = np.bincount(lab, weights=fn(vals), minlength=n_zones)
+    return acc
+
+def evaluate(metrics: list[Metric], acc: dict, threshold=None) -> dict:
+    # Finalize every metric from the shared accumulators, keyed by output column.
+    out = {}
+    for m in metrics:
+        out.update(m.finalize(acc, threshold))
+    return out
+
+def _share(part: np.ndarray, count: np.ndarray) -> np.ndarray:
+    # part / count in percent, NaN for empty zones.
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(count > 0, part / count * 100.0, np.nan)
+
+@register("below_threshold_pct", needs=("count", "below"), default=True)
+def below_threshold_pct(acc: dict, threshold) -> dict:
+    # Percent of pixels below each Tmin threshold (degC), one column per threshold of a sweep.
+    thr_cols = _threshold_columns(threshold)
+    count = acc["count"]
+    if thr_cols[0][1] is None:
+        return {"below_threshold_pct": np.full(count.shape, np.nan)}
+    return {col: _share(acc["below"][:, j], count) for j, (col, _) in enumerate(thr_cols)}
+
+@register("frost_degree_sum", needs=("count",), terms={"frost_deficit": lambda v: np.maximum(0.0, -v)},
+          extensive=True)
+def frost_degree_sum(acc: dict, threshold) -> dict:
+    # Sum over the zone's pixels of degrees below 0 degC (degC x pixels; per day for daily bands), NaN when empty.
+    return {"frost_degree_sum": np.where(acc["count"] > 0, acc["terms"]["frost_deficit"], np.nan)}
+
+@register("freezing_pct", needs=("count",), terms={"freezing": lambda v: (v < 0.0).astype(float)})
+def freezing_pct(acc: dict, threshold) -> dict:
+    # Percent of pixels below 0 degC (share of time below freezing when bands are time steps).
+    return {"freezing_pct": _share(acc["terms"]["freezing"], acc["count"])}
+
+# Share of a zone's coldest pixels averaged by cold_spell_intensity.
+COLD_TAIL = 0.1
+
+@register("cold_spell_intensity", needs=("sorted",))
+def cold_spell_intensity(acc: dict, threshold) -> dict:
+    # Mean Tmin of the coldest COLD_TAIL share of each zone's pixels (at least one pixel).
+    sorted_vals, starts = acc["sorted"]
+    count = acc["count"]
+    out = np.full(count.shape, np.nan)
+    has = count > 0
+    k = np.maximum(1, np.ceil(count[has] * COLD_TAIL - 1e-9)).astype(np.int64)
+    cs = np.concatenate([[0.0], np.cumsum(sorted_vals)])
+    out[has] = (cs[starts[has] + k] - cs[starts[has]]) / k
+    return {"cold_spell_intensity": out}
@@ -0,0 +1,285 @@
+from __future__ import annotations
+import os
+import json
+import shutil
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+import numpy as np
+import rasterio
+from src.utils import write_atomic
+
+# Bytes from the start of the file folded into the fingerprint (TIFF header and, usually, the first IFD).
+HEADER_BYTES = 64 * 1024
+
+def raster_fingerprint(raster_path: str) -> str:
+    # Identity of a raster file: absolute path, size, mtime and a hash of its header bytes.
+    st = os.stat(raster_path)
+    h = hashlib.sha256()
+    h.update(os.path.abspath(raster_path).encode())
+    h.update(f"{st.st_size}:{st.st_mtime_ns}".encode())
+    with open(raster_path, "rb") as f:
+        h.update(f.read(HEADER_BYTES))
+    return h.hexdigest()[:32]
+
+_CONTENT_HASHES = {}
+
+def raster_content_hash(raster_path: str, chunk_bytes: int = 8 * 1024 * 1024) -> str:
+    # sha256 of the file contents, memoized per process by (path, size, mtime) so reruns do not rehash.
+    st = os.stat(raster_path)
+    key = (os.path.abspath(raster_path), st.st_size, st.st_mtime_ns)
+    if key not in _CONTENT_HASHES:
+        h = hashlib.sha256()
+        with open(raster_path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_bytes), b""):
+                h.update(chunk)
+        _CONTENT_HASHES[key] = h.hexdigest()
+    return _CONTENT_HASHES[key]
+
+# Upper bound on the decoded band cache (uncompressed copies of every band); least recently used rasters go first.
+MAX_DECODED_BYTES = 4 * 1024 ** 3
+
+def _decoded_source(raster_path: str) -> str:
+    # A <stem>.cog.tif written by src.cog holds the same pixels as <stem>.tif, so both share one decoded copy.
+    if raster_path.endswith(".cog.tif"):
+        for ext in (".tif", ".tiff"):
+            source = raster_path[:-len(".cog.tif")] + ext
+            if os.path.exists(source):
+                return source
+    return raster_path
+
+def _decoded_entry(folder: str) -> tuple[float, int, bool, bool] | None:
+    # (newest mtime, bytes, busy, stale) of one decoded raster folder; None while its manifest is not written yet.
+    # busy: a band is being decoded; stale: the source file was deleted (e.g. an evicted upload) or rewritten.
+    try:
+        with open(os.path.join(folder, "manifest.json")) as f:
+            manifest = json.load(f)
+        files = [os.path.join(folder, n) for n in os.listdir(folder)]
+        stats = [os.stat(p) for p in files]
+    except (OSError, ValueError):
+        return None
+    busy = any(p.endswith(".tmp") for p in files)
+    source = manifest.get("path", "")
+    stale = (not os.path.exists(source)
+             or (os.path.getsize(source), os.path.getmtime(source)) != (manifest.get("size"), manifest.get("mtime")))
+    return max(st.st_mtime for st in stats), sum(st.st_size for st in stats), busy, stale
+
+def evict_decoded(cache_dir: str, max_bytes: int = MAX_DECODED_BYTES, keep=()) -> list[str]:
+    # Delete decoded rasters whose source is gone or changed, then least recently used ones until the cache fits in
+    # `max_bytes`. Folders in `keep` and folders with a band being decoded are never removed.
+    root = os.path.join(cache_dir, "decoded")
+    if not os.path.isdir(root):
+        return []
+    keep = {os.path.abspath(p) for p in keep}
+    entries = []
+    for name in os.listdir(root):
+        folder = os.path.join(root, name)
+        entry = _decoded_entry(folder) if os.path.isdir(folder) else None
+        if entry is not None:
+            mtime, size, busy, stale = entry
+            entries.append((not stale, mtime, size, busy, stale, folder))
+    total = sum(e[2] for e in entries)
+    removed = []
+    for _, _, size, busy, stale, folder in sorted(entries):
+        if total <= max_bytes and not stale:
+            break
+        if busy or os.path.abspath(folder) in keep:
+            continue
+        shutil.rmtree(folder, ignore_errors=True)
+        total -= size
+        removed.append(folder)
+    return removed
+
+class DecodedRaster:
+    # Read-through view of an open dataset whose bands are decoded once into raw .npy files and then memory-mapped.
+    # Attribute access (transform, nodata, height, ...) falls through to the rasterio dataset.
+    # The cache is trimmed to `max_bytes` (see evict_decoded) whenever a band is decoded.
+
+    def __init__(self, src, cache_dir: str, max_bytes: int = MAX_DECODED_BYTES):
+        self._src = src
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._source = _decoded_source(src.name)
+        self.folder = os.path.join(cache_dir, "decoded", raster_fingerprint(self._source))
+        self._bands = {}
+        self._ensure_folder()
+
+    def _ensure_folder(self) -> None:
+        # Create the folder and its manifest, again if another session evicted them since.
+        src, source = self._src, self._source
+        os.makedirs(self.folder, exist_ok=True)
+        manifest_path = os.path.join(self.folder, "manifest.json")
+        if not os.path.exists(manifest_path):
+            manifest = {
+                "path": os.path.abspath(source),
+                "size": os.path.getsize(source),
+                "mtime": os.path.getmtime(source),
+                "shape": [src.height, src.width],
+                "count": src.count,
+                "dtypes": list(src.dtypes),
+                "nodata": src.nodata,
+                "transform": list(src.transform)[:6],
+                "crs": src.crs.to_string() if src.crs is not None else None,
+            }
+            write_atomic(manifest_path, lambda f: f.write(json.dumps(manifest, indent=2).encode()))
+
+    def __getattr__(self, name):
+        return getattr(self._src, name)
+
+    def _decode(self, index: int, path: str) -> None:
+        # Decode band `index` block by block into a .npy file at `path`.
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=self._src.dtypes[index - 1],
+                                        shape=(self._src.height, self._src.width))
+        for _, win in self._src.block_windows(index):
+            (r0, r1), (c0, c1) = win.toranges()
+            out[r0:r1, c0:c1] = self._src.read(index, window=win)
+        out.flush()
+        del out
+
+    def band(self, index: int) -> np.ndarray:
+        # Memory-mapped band `index`, decoding it block by block into the cache on first use.
+        if index in self._bands:
+            return self._bands[index]
+        path = os.path.join(self.folder, f"band_{index}.npy")
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            self._ensure_folder()
+            write_atomic(path, lambda f: self._decode(index, f.name))
+            evict_decoded(self.cache_dir, self.max_bytes, keep=(self.folder,))
+        self._bands[index] = np.load(path, mmap_mode="r")
+        return self._bands[index]
+
+    def read(self, indexes=None, window=None, **kwargs) -> np.ndarray:
+        # Same contract as DatasetReader.read for in-bounds windows: an int gives 2-D, a list gives 3-D.
+        # Resampled reads (out_shape=..., resampling=...) go to the dataset so GDAL can use its overviews.
+        if kwargs:
+            return self._src.read(indexes, window=window, **kwargs)
+        single = isinstance(indexes, (int, np.integer))
+        bands = [indexes] if single else list(indexes) if indexes is not None else list(range(1, self._src.count + 1))
+        if window is None:
+            arrays = [self.band(b) for b in bands]
+        else:
+            (r0, r1), (c0, c1) = window.toranges()
+            arrays = [self.band(b)[r0:r1, c0:c1] for b in bands]
+        return arrays[0] if single else np.stack(arrays)
+
+def _same_file(key: tuple) -> bool:
+    # Whether the (path, size, mtime) key of a pooled raster still describes the file on disk.
+    try:
+        st = os.stat(key[0])
+    except OSError:
+        return False
+    return (st.st_size, st.st_mtime_ns) == key[1:]
+
+class DatasetPool:
+    # Thread-safe pool of open rasterio readers: up to `per_raster` idle handles per file are kept open and lent
+    # out exclusively, with the header metadata (nodata, transform, CRS, band count, block layout) parsed once.
+    # Handles are keyed by (path, size, mtime), so a rewritten file is reopened and its old handles closed.
+    # At most `max_rasters` files keep idle handles (least recently returned first out), and handles of deleted
+    # files are closed (prune), so evicted uploads release their disk space.
+
+    def __init__(self, per_raster: int = 4, max_rasters: int = 16):
+        self.per_raster = per_raster
+        self.max_rasters = max_rasters
+        self._idle = OrderedDict()
+        self._meta = {}
+        self._lock = threading.Lock()
+
+    def _key(self, raster_path: str) -> tuple:
+        st = os.stat(raster_path)
+        return os.path.abspath(raster_path), st.st_size, st.st_mtime_ns
+
+    def _drop(self, keys) -> list:
+        # Idle handles and metadata of `keys` (caller holds the lock); the handles are closed by the caller.
+        keys = set(keys)
+        for k in [k for k in self._meta if k in keys]:
+            del self._meta[k]
+        return [src for k in [k for k in self._idle if k in keys] for src in self._idle.pop(k)]
+
+    def _drop_stale(self, key: tuple) -> list:
+        # Idle handles and metadata of older versions of the same file (caller holds the lock).
+        return self._drop([k for k in list(self._idle) + list(self._meta) if k[0] == key[0] and k != key])
+
+    def prune(self) -> int:
+        # Close idle handles of files that were deleted or rewritten; returns how many were closed.
+        with self._lock:
+            keys = set(self._idle) | set(self._meta)
+            handles = self._drop([k for k in keys if not _same_file(k)])
+        for src in handles:
+            src.close()
+        return len(handles)
+
+    @contextmanager
+    def borrow(self, raster_path: str):
+        # An open dataset for `raster_path`, used by one caller at a time and returned to the pool afterwards.
+        self.prune()
+        key = self._key(raster_path)
+        with self._lock:
+            stale = self._drop_stale(key)
+            idle = self._idle.get(key)
+            src = idle.pop() if idle else None
+        for old in stale:
+            old.close()
+        if src is None:
+            src = rasterio.open(raster_path)
+        try:
+            yield src
+        finally:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                self._idle.move_to_end(key)
+                if not src.closed and len(idle) < self.per_raster and _same_file(key):
+                    idle.append(src)
+                    src = None
+                if not idle:
+                    del self._idle[key]
+                evicted = self._drop(list(self._idle)[:max(0, len(self._idle) - self.max_rasters)])
+            for old in evicted + ([src] if src is not None else []):
+                old.close()
+
+    def meta(self, raster_path: str) -> dict:
+        # Cached header metadata of `raster_path`.
+        key = self._key(raster_path)
+        with self._lock:
+            if key in self._meta:
+                return self._meta[key]
+        with self.borrow(raster_path) as src:
+            meta = {
+                "count": src.count,
+                "height": src.height,
+                "width": src.width,
+                "dtypes": list(src.dtypes),
+                "nodata": src.nodata,
+                "transform": src.transform,
+                "crs": src.crs,
+                "block_shapes": list(src.block_shapes),
+                "overviews": src.overviews(1),
+            }
+        with self._lock:
+            self._meta[key] = meta
+        return meta
+
+    def close(self) -> None:
+        # Close every idle handle and forget cached metadata.
+        with self._lock:
+            handles = [src for idle in self._idle.values() for src in idle]
+            self._idle.clear()
+            self._meta.clear()
+        for src in handles:
+            src.close()
+
+# Process-wide pool shared by open_raster, the app and the other modules.
+POOL = DatasetPool()
+
+def raster_meta(raster_path: str) -> dict:
+    # Header metadata of a raster from the shared pool (no reopen or header parse after the first call).
+    return POOL.meta(raster_path)
+
+@contextmanager
+def open_raster(raster_path: str, decoded_cache: str | None = None):
+    # rasterio dataset for `raster_path` borrowed from the shared pool, wrapped in DecodedRaster when a decoded
+    # cache directory is given.
+    with POOL.borrow(raster_path) as src:
+        yield src if decoded_cache is None else DecodedRaster(src, decoded_cache)
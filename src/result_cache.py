@@ -0,0 +1,49 @@
+from __future__ import annotations
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+def nbytes_of(obj) -> int:
+    # Approximate in-memory size of a cached result (DataFrames, arrays, xarray objects and tuples of them).
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, (np.ndarray, xr.DataArray, xr.Dataset)):
+        return int(obj.nbytes)
+    if isinstance(obj, (tuple, list)):
+        return sum(nbytes_of(o) for o in obj)
+    return sys.getsizeof(obj)
+
+class ResultCache:
+    # Thread-safe LRU of computed results, evicting least recently used entries beyond `max_bytes`.
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._items:
+                return default
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key, value) -> None:
+        size = nbytes_of(value)
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size)
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, old) = self._items.popitem(last=False)
+                self.nbytes -= old
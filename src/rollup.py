@@ -0,0 +1,49 @@
+from __future__ import annotations
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import xarray as xr
+
+# UBIGEO is DDPPdd (department, province, district), so coarser levels are its prefixes.
+LEVEL_PREFIX = {"province": 4, "department": 2}
+LEVEL_NAME = {"province": "PROVINCIA_N", "department": "DEPARTAMENTO"}
+
+def level_keys(gdf: gpd.GeoDataFrame, level: str) -> np.ndarray:
+    # Group key of each district at `level`: the UBIGEO prefix, or the level's name column when UBIGEO is missing.
+    level = level.lower()
+    if level == "district":
+        return np.arange(len(gdf))
+    if level not in LEVEL_PREFIX:
+        raise ValueError("level must be one of: district, province, department")
+    if "UBIGEO" in gdf.columns and gdf["UBIGEO"].notna().all():
+        return gdf["UBIGEO"].astype(str).str[:LEVEL_PREFIX[level]].to_numpy()
+    return gdf[LEVEL_NAME[level]].astype(str).to_numpy()
+
+def rollup_sufficient(ds: xr.Dataset, keys) -> xr.Dataset:
+    # Merge zone sufficient statistics by key: counts, sums and histograms add, min/max reduce.
+    uniq, inv = np.unique(np.asarray(keys), return_inverse=True)
+    order = np.argsort(inv, kind="stable")
+    starts = np.searchsorted(inv[order], np.arange(uniq.size))
+    out = {}
+    for name, da in ds.data_vars.items():
+        vals = da.values[order]
+        if name == "hist":
+            vals = vals.astype(np.uint64)
+        ufunc = {"min": np.minimum, "max": np.maximum}.get(name, np.add)
+        out[name] = (da.dims, ufunc.reduceat(vals, starts, axis=0))
+    coords = {c: ds.coords[c] for c in ds.coords if c not in ("zone", "UBIGEO")}
+    coords["zone"] = np.arange(uniq.size)
+    coords["key"] = ("zone", uniq)
+    return xr.Dataset(out, coords=coords, attrs=ds.attrs)
+
+def rollup_level(gdf: gpd.GeoDataFrame, ds: xr.Dataset, level: str) -> tuple[pd.DataFrame, xr.Dataset]:
+    # Province/department sufficient statistics from district ones, without dissolving geometries.
+    # Returns the per-group admin columns (first district of each group, like dissolve_level) and the merged Dataset.
+    if level.lower() == "district":
+        return gdf.drop(columns="geometry"), ds
+    keys = level_keys(gdf, level)
+    rolled = rollup_sufficient(ds, keys)
+    cols = [c for c in ["DEPARTAMENTO","PROVINCIA_N","DISTRITO_N","UBIGEO"] if c in gdf.columns]
+    meta = pd.DataFrame(gdf[cols]).assign(_key=keys).groupby("_key", sort=True).first()
+    meta = meta.loc[rolled["key"].values].reset_index(drop=True)
+    return meta, rolled
@@ -0,0 +1,121 @@
+from __future__ import annotations
+import os
+import glob
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as pads
+from src.labels import CACHE_DIR
+from src.utils import write_atomic
+
+try:
+    import duckdb
+except ImportError:  # optional: only needed for sql()
+    duckdb = None
+
+# Hive-partitioned Parquet store, keyed by UBIGEO:
+# raster=<content hash>/layer=<zone file fingerprint>/level=<level>/band=<n>/threshold=<t>.parquet.
+STORE_DIR = os.path.join(os.path.dirname(CACHE_DIR), "results")
+PARTITIONING = pads.partitioning(pa.schema([("raster", pa.string()), ("layer", pa.string()), ("level", pa.string()),
+                                            ("band", pa.int32())]), flavor="hive")
+STORE_GLOB = ("raster=*", "layer=*", "level=*", "band=*", "*.parquet")
+META_COLS = ["DEPARTAMENTO", "PROVINCIA_N", "DISTRITO_N", "UBIGEO"]
+
+def _threshold_name(threshold) -> str:
+    return "none" if threshold is None else f"{float(threshold):g}"
+
+def result_path(raster_hash: str, zones_hash: str, level: str, band: int, threshold=None,
+                store_dir: str = STORE_DIR) -> str:
+    # `zones_hash` identifies the zone layer (e.g. utils.file_fingerprint of the shapefile), so tables computed
+    # from an edited shapefile are never served for the new one.
+    return os.path.join(store_dir, f"raster={raster_hash}", f"layer={zones_hash}", f"level={level}",
+                        f"band={int(band)}", f"threshold={_threshold_name(threshold)}.parquet")
+
+def write_results(df: pd.DataFrame, raster_hash: str, zones_hash: str, level: str, band: int, threshold=None,
+                  store_dir: str = STORE_DIR) -> str:
+    # Persist one attach_index table, sorted by UBIGEO so row-group statistics serve key lookups.
+    path = result_path(raster_hash, zones_hash, level, band, threshold, store_dir)
+    out = df.copy()
+    for c in META_COLS:
+        if c in out.columns:
+            out[c] = out[c].astype("string")
+    out["threshold"] = np.nan if threshold is None else float(threshold)
+    if "UBIGEO" in out.columns:
+        out = out.sort_values("UBIGEO", kind="stable")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    write_atomic(path, lambda f: out.to_parquet(f, index=False))
+    return path
+
+def read_results(raster_hash: str, zones_hash: str, level: str, band: int, threshold=None,
+                 store_dir: str = STORE_DIR) -> pd.DataFrame | None:
+    # The stored table for one (raster, zone layer, level, band, threshold), or None if it was never computed.
+    path = result_path(raster_hash, zones_hash, level, band, threshold, store_dir)
+    if not os.path.exists(path):
+        return None
+    return pd.read_parquet(path).drop(columns="threshold")
+
+def _dataset(store_dir: str):
+    files = glob.glob(os.path.join(store_dir, *STORE_GLOB))
+    if not files:
+        return None
+    schemas = [pads.dataset(f, format="parquet").schema for f in files]
+    schema = pa.unify_schemas(schemas + [PARTITIONING.schema])
+    return pads.dataset(files, schema=schema, format="parquet", partitioning=PARTITIONING,
+                        partition_base_dir=store_dir)
+
+def load_results(raster_hash: str | None = None, level: str | None = None, band: int | None = None,
+                 threshold=None, zones_hash: str | None = None, store_dir: str = STORE_DIR) -> pd.DataFrame:
+    # Stored rows with partition columns (raster, layer, level, band), filtered by partition pruning.
+    # threshold=None keeps one row per zone whatever threshold it was stored with.
+    dataset = _dataset(store_dir)
+    if dataset is None:
+        return pd.DataFrame()
+    expr = None
+    for field, value in (("raster", raster_hash), ("layer", zones_hash), ("level", level), ("band", band)):
+        if value is not None:
+            cond = pads.field(field) == value
+            expr = cond if expr is None else expr & cond
+    if threshold is not None:
+        cond = pads.field("threshold") == float(threshold)
+        expr = cond if expr is None else expr & cond
+    df = dataset.to_table(filter=expr).to_pandas()
+    if threshold is None and not df.empty:
+        df = df.drop_duplicates(["raster", "layer", "level", "band", "UBIGEO"])
+    return df.reset_index(drop=True)
+
+def coldest(n: int = 15, level: str = "district", raster_hash: str | None = None, zones_hash: str | None = None,
+            store_dir: str = STORE_DIR) -> pd.DataFrame:
+    # Top-N zones with the lowest mean Tmin for every stored band (year) of each zone layer.
+    df = load_results(raster_hash, level, zones_hash=zones_hash, store_dir=store_dir)
+    if df.empty:
+        return df
+    return (df.sort_values(["band", "mean"]).groupby(["raster", "layer", "band"], sort=False).head(n)
+            .reset_index(drop=True))
+
+def zone_history(ubigeo: str, level: str = "district", raster_hash: str | None = None,
+                 zones_hash: str | None = None, store_dir: str = STORE_DIR) -> pd.DataFrame:
+    # One zone (by UBIGEO) across all stored bands (one row per band and zone layer).
+    df = load_results(raster_hash, level, zones_hash=zones_hash, store_dir=store_dir)
+    if df.empty:
+        return df
+    return df[df["UBIGEO"] == str(ubigeo)].sort_values("band").reset_index(drop=True)
+
+def risk_counts(min_pct: float, threshold: float, level: str = "district", raster_hash: str | None = None,
+                zones_hash: str | None = None, store_dir: str = STORE_DIR) -> pd.DataFrame:
+    # Per band and zone layer: zones whose below_threshold_pct (for `threshold`) is at least `min_pct`.
+    df = load_results(raster_hash, level, threshold=threshold, zones_hash=zones_hash, store_dir=store_dir)
+    if df.empty:
+        return pd.DataFrame(columns=["raster", "layer", "band", "zones"])
+    hit = df[df["below_threshold_pct"] >= min_pct]
+    return hit.groupby(["raster", "layer", "band"]).size().rename("zones").reset_index()
+
+def sql(query: str, store_dir: str = STORE_DIR) -> pd.DataFrame:
+    # Ad-hoc DuckDB SQL over the store, exposed as the view `zonal` (requires the optional duckdb package).
+    if duckdb is None:
+        raise ImportError("sql() needs duckdb; install it or use load_results()")
+    con = duckdb.connect()
+    pattern = os.path.join(store_dir, *STORE_GLOB).replace("'", "''")
+    con.execute(f"CREATE VIEW zonal AS SELECT * FROM read_parquet('{pattern}', hive_partitioning = true, "
+                f"union_by_name = true, hive_types = {{'raster': 'VARCHAR', 'layer': 'VARCHAR', 'level': 'VARCHAR', "
+                f"'band': 'INTEGER'}})")
+    return con.execute(query).df()
@@ -0,0 +1,67 @@
+from __future__ import annotations
+import os
+import hashlib
+from src.labels import CACHE_DIR
+from src.raster_cache import POOL
+from src.utils import temp_file
+
+UPLOAD_DIR = os.path.join(CACHE_DIR, "uploads")
+MAX_UPLOAD_BYTES = 2 * 1024 ** 3
+
+def store_upload(fileobj, upload_dir: str = UPLOAD_DIR, suffix: str = ".tif", max_bytes: int = MAX_UPLOAD_BYTES,
+                 chunk_bytes: int = 8 * 1024 * 1024) -> tuple[str, str]:
+    # Stream an uploaded file to disk in chunks under its sha256 name; returns (path, sha256).
+    # An identical earlier upload is reused, and the store is trimmed to `max_bytes` (least recently used first).
+    os.makedirs(upload_dir, exist_ok=True)
+    if hasattr(fileobj, "seek"):
+        fileobj.seek(0)
+    h = hashlib.sha256()
+    with temp_file(upload_dir, suffix=".part") as f:
+        for chunk in iter(lambda: fileobj.read(chunk_bytes), b""):
+            h.update(chunk)
+            f.write(chunk)
+        f.close()
+        digest = h.hexdigest()
+        path = os.path.join(upload_dir, digest + suffix)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            os.replace(f.name, path)
+    evict_uploads(upload_dir, max_bytes, keep=(path,))
+    return path, digest
+
+def _upload_key(name: str) -> str:
+    # Files of one upload share its sha256 stem: <hash>.tif and its optimized copy <hash>.cog.tif (src.cog).
+    return name.split(".", 1)[0]
+
+def evict_uploads(upload_dir: str = UPLOAD_DIR, max_bytes: int = MAX_UPLOAD_BYTES, keep=()) -> list[str]:
+    # Delete least recently used uploads (by newest mtime) until the store fits in `max_bytes`. An upload and its
+    # COG copy are one unit, so keeping an upload keeps its COG; uploads still being written (.part) or converted
+    # (*.tmp.tif) are never touched.
+    keep = {_upload_key(os.path.basename(p)) for p in keep}
+    units, busy = {}, set()
+    for name in os.listdir(upload_dir):
+        p = os.path.join(upload_dir, name)
+        if not os.path.isfile(p):
+            continue
+        if name.endswith(".part") or name.endswith(".tmp.tif"):
+            busy.add(_upload_key(name))
+            continue
+        st = os.stat(p)
+        mtime, size, paths = units.get(_upload_key(name), (0.0, 0, []))
+        units[_upload_key(name)] = (max(mtime, st.st_mtime), size + st.st_size, paths + [p])
+    total = sum(size for _, size, _ in units.values())
+    removed = []
+    for key, (_, size, paths) in sorted(units.items(), key=lambda kv: kv[1][0]):
+        if total <= max_bytes:
+            break
+        if key in keep or key in busy:
+            continue
+        for p in paths:
+            os.remove(p)
+        total -= size
+        removed.extend(paths)
+    if removed:
+        # Pooled readers of the deleted files would otherwise keep their disk space allocated.
+        POOL.prune()
+    return removed
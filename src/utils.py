@@ -1,7 +1,12 @@
 
 from __future__ import annotations
+import os
+import glob
+import hashlib
 import unicodedata
 import re
+import tempfile
+from contextlib import contextmanager
 import geopandas as gpd
 
 def slugify(text: str) -> str:
@@ -65,3 +70,32 @@ def dissolve_level(gdf: gpd.GeoDataFrame, level: str) -> gpd.GeoDataFrame:
     cols = [c for c in ["DEPARTAMENTO","PROVINCIA_N","DISTRITO_N","UBIGEO"] if c in gdf.columns]
     dissolved = gdf[cols + ["geometry"]].dissolve(by=key, as_index=False, aggfunc="first")
     return dissolved
+
+def file_fingerprint(path: str) -> str:
+    # Size + mtime hash of a vector file and its sidecars (e.g. .shp/.shx/.dbf/.prj/.cpg), for cache keys.
+    stem, _ = os.path.splitext(path)
+    h = hashlib.sha256()
+    for p in sorted(glob.glob(glob.escape(stem) + ".*")):
+        st = os.stat(p)
+        h.update(f"{os.path.basename(p)}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()[:16]
+
+@contextmanager
+def temp_file(folder: str, suffix: str = ".tmp"):
+    # Unique temp file in `folder`, open for binary writing (its path is f.name) and removed on exit unless the
+    # caller renamed it into place. Names must be unique per writer, not per PID: Streamlit sessions are threads.
+    fd, tmp = tempfile.mkstemp(dir=folder, suffix=suffix)
+    os.close(fd)
+    try:
+        with open(tmp, "wb") as f:
+            yield f
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+def write_atomic(path: str, write) -> None:
+    # write(f) into a temp file next to `path`, then rename it into place, so readers never see a partial file.
+    with temp_file(os.path.dirname(path)) as f:
+        write(f)
+        f.close()
+        os.replace(f.name, path)
@@ -1,66 +1,669 @@
-
 from __future__ import annotations
+import math
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import numpy as np
 import geopandas as gpd
 import pandas as pd
-import rasterio
-from rasterstats import zonal_stats
+import xarray as xr
+import shapely
+from affine import Affine
+from rasterio.enums import Resampling
+from rasterio.features import geometry_mask
+from rasterio.windows import Window, transform as window_transform
+from src import histogram, kernels, sketch
+from src.labels import CACHE_DIR, CENTRE, zone_labels, zone_matrix
+from src.metrics import REGISTRY, accumulate, evaluate, requirements, resolve, threshold_column, _threshold_columns
+from src.raster_cache import open_raster
+
+# Default percentiles; compute_zonal_stats(percentiles=...) adds one percentile_<q> column per value instead.
+PERCENTILES = (10, 90)
+
+def percentile_column(q: float) -> str:
+    # Column name of a percentile, e.g. percentile_10 or percentile_2.5.
+    return f"percentile_{float(q):g}"
+
+def metric_columns(percentiles=PERCENTILES) -> list[str]:
+    # Standard metric columns with one percentile column per value of `percentiles`.
+    return ["count", "mean", "min", "max", "std"] + [percentile_column(q) for q in percentiles]
+
+METRICS = metric_columns()
+BASE_METRICS = METRICS[:5]
+
+def metric_plan(metrics=None, percentiles=PERCENTILES) -> tuple[list[str], tuple, list[str]]:
+    # Requested standard metric columns, the percentiles among them (percentile_<q> names) and the registered
+    # src.metrics names; None means all METRICS with `percentiles`. Only what is requested is computed:
+    # percentiles trigger the sort, std the sum of squares, registered metrics their declared accumulators.
+    # Every backend and sufficient_frame go through here, so out-of-range percentiles fail the same way everywhere.
+    pcts, extras = [], []
+    if metrics is None:
+        pcts = list(percentiles)
+    for m in metrics or ():
+        if m in REGISTRY:
+            extras.append(m)
+        elif m.startswith("percentile_"):
+            pcts.append(float(m[len("percentile_"):]))
+        elif m not in BASE_METRICS:
+            raise ValueError(f"unknown metric {m!r}; expected one of {', '.join(BASE_METRICS)}, percentile_<q> "
+                             f"or a registered metric ({', '.join(REGISTRY)})")
+    bad = [q for q in pcts if not 0 <= float(q) <= 100]
+    if bad:
+        raise ValueError(f"percentiles must be between 0 and 100, got {', '.join(f'{float(q):g}' for q in bad)}")
+    if metrics is None:
+        return metric_columns(pcts), tuple(pcts), []
+    columns = [m for m in metric_columns(pcts) if m in metrics or m.startswith("percentile_")]
+    return columns, tuple(pcts), extras
+
+def _select_metrics(df: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+    # Drop the standard metric columns (and their _all_touched twins) that were not requested.
+    skip = [m for m in BASE_METRICS if m not in columns]
+    return df.drop(columns=[c for c in df.columns if c.removesuffix("_all_touched") in skip])
 
-METRICS = ["count","mean","min","max","std","percentile_10","percentile_90"]
+def _zone_window(bounds, transform, height: int, width: int) -> Window | None:
+    # Full-cover pixel window of a geometry's bounds (same rounding as rasterstats), clipped to the raster.
+    w, s, e, n = bounds
+    row_start = int(math.floor((n - transform.f) / transform.e))
+    col_start = int(math.floor((w - transform.c) / transform.a))
+    row_stop = int(math.ceil((s - transform.f) / transform.e))
+    col_stop = int(math.ceil((e - transform.c) / transform.a))
+    row_start, col_start = max(row_start, 0), max(col_start, 0)
+    row_stop, col_stop = min(row_stop, height), min(col_stop, width)
+    if row_stop <= row_start or col_stop <= col_start:
+        return None
+    return Window(col_start, row_start, col_stop - col_start, row_stop - row_start)
 
-def _custom_metrics(arr: np.ndarray, nodata=None, threshold: float | None = None) -> dict:
-    # Custom metric: percent of pixels below a Tmin threshold (degC).
-    result = {}
-    if arr is None:
-        return {"below_threshold_pct": np.nan}
-    data = arr[~np.isnan(arr)]
+def _masked_values(stack: np.ndarray, inside: np.ndarray, nodata) -> list[np.ndarray]:
+    # Valid pixel values inside the polygon mask, per band of a (bands, rows, cols) window stack.
+    out = []
+    for arr in stack:
+        valid = inside.copy()
+        if nodata is not None:
+            valid &= arr != nodata
+        if np.issubdtype(arr.dtype, np.floating):
+            valid &= ~np.isnan(arr)
+        out.append(arr[valid].astype(float))
+    return out
+
+def _zone_values(src, geom, bands: list[int], nodata, all_touched: bool = False) -> list[np.ndarray]:
+    # Valid pixel values of one polygon for each band in `bands`, read from its window in a single decode.
+    if geom is None or geom.is_empty:
+        return [np.empty(0) for _ in bands]
+    win = _zone_window(geom.bounds, src.transform, src.height, src.width)
+    if win is None:
+        return [np.empty(0) for _ in bands]
+    stack = src.read(bands, window=win)
+    inside = geometry_mask([geom], out_shape=stack.shape[1:], transform=src.window_transform(win),
+                           invert=True, all_touched=all_touched)
+    return _masked_values(stack, inside, nodata)
+
+def _zone_summary(data: np.ndarray, threshold=None, percentiles=PERCENTILES, extras=()) -> dict:
+    # Standard metrics plus the registered metrics (below-threshold column(s) and `extras`) from one array of
+    # valid pixel values.
+    registered = resolve(extras)
+    needs, terms = requirements(registered)
+    thresholds = [t for _, t in _threshold_columns(threshold) if t is not None]
+    acc = accumulate(np.zeros(data.size, dtype=np.int64), data, 1, needs, terms, thresholds)
+    custom = {col: float(v[0]) for col, v in evaluate(registered, acc, threshold).items()}
     if data.size == 0:
-        return {"below_threshold_pct": np.nan}
-    if threshold is None:
-        return {"below_threshold_pct": np.nan}
-    result["below_threshold_pct"] = float((data < threshold).sum()) / float(data.size) * 100.0
-    return result
+        row = {m: np.nan for m in metric_columns(percentiles)}
+        row["count"] = 0
+        row.update(custom)
+        return row
+    row = {
+        "count": int(data.size),
+        "mean": float(data.mean()),
+        "min": float(data.min()),
+        "max": float(data.max()),
+        "std": float(data.std()),
+    }
+    row.update({percentile_column(q): float(v) for q, v in zip(percentiles, np.percentile(data, list(percentiles)))})
+    row.update(custom)
+    return row
+
+def _segment_percentile(sorted_vals: np.ndarray, starts: np.ndarray, counts: np.ndarray, q) -> np.ndarray:
+    # Linear-interpolated percentile(s) (np.percentile default) of every zone segment of a label-sorted value
+    # array, read from the segment offsets; a sequence `q` gives an n_zones x len(q) array in one step.
+    qs = np.atleast_1d(np.asarray(q, dtype=float))
+    out = np.full((counts.size, qs.size), np.nan)
+    has = counts > 0
+    n = counts[has, None]
+    pos = (n - 1) * (qs / 100.0)
+    lo = np.floor(pos).astype(np.int64)
+    hi = np.minimum(lo + 1, n - 1)
+    frac = pos - lo
+    v_lo = sorted_vals[starts[has, None] + lo]
+    v_hi = sorted_vals[starts[has, None] + hi]
+    out[has] = v_lo + (v_hi - v_lo) * frac
+    return out if np.ndim(q) else out[:, 0]
+
+def _segment_weighted_percentile(sorted_vals: np.ndarray, sorted_w: np.ndarray, starts: np.ndarray,
+                                 counts: np.ndarray, q: float) -> np.ndarray:
+    # Weighted percentile per segment: value i sits at the midpoint of its weight, (weight before i + w_i / 2) / total,
+    # with linear interpolation between midpoints and the segment min/max beyond the first/last one.
+    out = np.full(counts.shape, np.nan)
+    has = counts > 0
+    if not has.any():
+        return out
+    seg = np.repeat(np.arange(counts.size), counts)
+    cum = np.cumsum(sorted_w)
+    base = np.where(has, cum[np.maximum(starts, 0) - 1] * (starts > 0), 0.0)
+    ends = starts + counts - 1
+    total = np.zeros(counts.shape)
+    total[has] = cum[ends[has]] - base[has]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        u = np.where(total[seg] > 0, (cum - sorted_w / 2.0 - base[seg]) / total[seg], 0.0)
+    z = np.flatnonzero(has)
+    i = np.searchsorted(seg * 2.0 + u, z * 2.0 + q / 100.0, side="right") - 1
+    i = np.clip(i, starts[z], ends[z])
+    j = np.minimum(i + 1, ends[z])
+    with np.errstate(invalid="ignore", divide="ignore"):
+        frac = np.where(u[j] > u[i], (q / 100.0 - u[i]) / (u[j] - u[i]), 0.0)
+    out[z] = sorted_vals[i] + (sorted_vals[j] - sorted_vals[i]) * np.clip(frac, 0.0, 1.0)
+    return out
+
+def _label_pixels(arr: np.ndarray, labels: np.ndarray, nodata=None) -> tuple[np.ndarray, np.ndarray]:
+    # Zero-based zone index and value of every valid, labelled pixel of a band.
+    valid = labels > 0
+    if nodata is not None:
+        valid &= arr != nodata
+    if np.issubdtype(arr.dtype, np.floating):
+        valid &= ~np.isnan(arr)
+    return labels[valid].astype(np.int64) - 1, arr[valid].astype(float)
+
+def _order_stats(lab: np.ndarray, vals: np.ndarray, counts: np.ndarray, weights: np.ndarray | None = None,
+                 percentiles=PERCENTILES) -> dict:
+    # min, max and percentile_<q> columns of every zone from one sort by (zone, value) and the segment offsets.
+    # With pixel weights (coverage fractions) the percentiles are weighted.
+    has = counts > 0
+    order = np.lexsort((vals, lab))
+    sorted_vals = vals[order]
+    starts = np.cumsum(counts) - counts
+    vmin = np.full(counts.shape, np.nan)
+    vmax = np.full(counts.shape, np.nan)
+    vmin[has] = sorted_vals[starts[has]]
+    vmax[has] = sorted_vals[starts[has] + counts[has] - 1]
+    if weights is None:
+        pct = _segment_percentile(sorted_vals, starts, counts, list(percentiles))
+    else:
+        pct = np.column_stack([_segment_weighted_percentile(sorted_vals, weights[order], starts, counts, q)
+                               for q in percentiles] or [np.empty((counts.size, 0))])
+    return {"min": vmin, "max": vmax, **{percentile_column(q): pct[:, j] for j, q in enumerate(percentiles)}}
+
+def _grouped_summary(arr: np.ndarray, labels: np.ndarray, n_zones: int, nodata=None, threshold=None,
+                     percentiles=PERCENTILES, extras=()) -> pd.DataFrame:
+    # Standard METRICS plus the registered metrics for all zones of a label grid: moments, min/max and threshold
+    # counts from one fused kernel pass (src.kernels); percentiles and any other accumulator the registered
+    # metrics need (sorted values, histograms, per-pixel terms) from one more pass over the labelled pixels.
+    registered = resolve(extras)
+    needs, terms = requirements(registered)
+    thresholds = [t for _, t in _threshold_columns(threshold) if t is not None]
+    mom = kernels.zone_moments(arr, labels, n_zones, nodata=nodata, thresholds=thresholds)
+    counts = mom["count"]
+    has = counts > 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(has, mom["sum"] / counts, np.nan)
+        var = np.where(has, mom["sumsq"] / counts - mean ** 2, np.nan)
+
+    acc = {k: mom[k] for k in ("count", "sum", "sumsq", "below")}
+    if percentiles:
+        needs.add("sorted")
+    if needs - set(acc) or terms:
+        lab, vals = _label_pixels(arr, labels, nodata)
+        acc = accumulate(lab, vals, n_zones, needs, terms, thresholds, acc=acc)
+    pct = _segment_percentile(*acc["sorted"], counts, list(percentiles)) if percentiles else None
+    return pd.DataFrame({
+        "count": counts,
+        "mean": mean,
+        "min": np.where(has, mom["min"], np.nan),
+        "max": np.where(has, mom["max"], np.nan),
+        "std": np.sqrt(np.clip(var, 0.0, None)),
+        **{percentile_column(q): pct[:, j] for j, q in enumerate(percentiles)},
+        **evaluate(registered, acc, threshold),
+    })
+
+def _sparse_summaries(matrix, stack: np.ndarray, nodata=None, threshold=None, coverage: bool = False,
+                      percentiles=PERCENTILES, metrics=None, extras=()) -> list[pd.DataFrame]:
+    # METRICS plus the registered metrics (below-threshold column(s) and `extras`) for every band of a
+    # (bands, rows, cols) stack and a zone x pixel CSR matrix: counts, sums and sums of squares of all bands are
+    # each one sparse (zones x pixels) @ (pixels x bands) product; min/max/percentiles need one (zone, value) sort
+    # per band over the matrix entries.
+    # coverage=True treats the matrix entries as coverage fractions: mean/std/percentiles and threshold shares are
+    # weighted, count is the number of (partly) covered valid pixels and `coverage` their summed fraction.
+    # `metrics` (default: all) skips the products and reductions nothing asked for; skipped columns are NaN.
+    # Registered metrics get count (weighted), sum, sumsq, below and their per-pixel terms as matrix products too;
+    # sorted values and histograms come from the matrix entries (unweighted, so not with coverage=True).
+    need = set(BASE_METRICS if metrics is None else metrics)
+    registered = resolve(extras)
+    needs, terms = requirements(registered)
+    if coverage and needs & {"hist", "sorted"}:
+        raise ValueError("metrics needing sorted values or histograms are not supported with coverage=True")
+    n_zones = matrix.shape[0]
+    x = stack.reshape(stack.shape[0], -1).T
+    valid = np.ones(x.shape, dtype=bool)
+    if nodata is not None:
+        valid &= x != nodata
+    if np.issubdtype(x.dtype, np.floating):
+        valid &= ~np.isnan(x)
+    xv = np.where(valid, x, 0).astype(float)
+    vf = valid.astype(float)
+    weight = matrix @ vf
+    counts = np.rint(matrix.astype(bool).astype(float) @ vf if coverage else weight).astype(np.int64)
+    sums = matrix @ xv if need & {"mean", "std"} or "sum" in needs else np.full(weight.shape, np.nan)
+    sumsq = matrix @ (xv * xv) if "std" in need or "sumsq" in needs else np.full(weight.shape, np.nan)
+    thresholds = [t for _, t in _threshold_columns(threshold) if t is not None]
+    below = np.stack([matrix @ (valid & (xv < t)).astype(float) for t in thresholds], axis=-1) \
+        if thresholds else np.zeros(weight.shape + (0,))
+    term_sums = {name: matrix @ np.where(valid, fn(xv), 0.0) for name, fn in terms.items()}
+
+    rows = np.repeat(np.arange(n_zones), np.diff(matrix.indptr))
+    out = []
+    for j in range(x.shape[1]):
+        cnt, w = counts[:, j], weight[:, j]
+        has = cnt > 0
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(has, sums[:, j] / w, np.nan)
+            var = np.where(has, sumsq[:, j] / w - mean ** 2, np.nan)
+        ok = valid[matrix.indices, j]
+        acc = {"count": w if coverage else cnt, "sum": sums[:, j], "sumsq": sumsq[:, j], "below": below[:, j],
+               "terms": {name: v[:, j] for name, v in term_sums.items()}}
+        if needs & {"hist", "sorted"}:
+            acc = accumulate(rows[ok], xv[matrix.indices[ok], j], n_zones, needs, acc=acc)
+        if percentiles:
+            order = _order_stats(rows[ok], xv[matrix.indices[ok], j], cnt, matrix.data[ok] if coverage else None,
+                                 percentiles=percentiles)
+        else:
+            order = {"min": np.full(n_zones, np.nan), "max": np.full(n_zones, np.nan)}
+            if need & {"min", "max"} and has.any():
+                # Entries are grouped by zone (CSR rows), so min/max are segment reductions without a sort.
+                vals, starts = xv[matrix.indices[ok], j], (np.cumsum(cnt) - cnt)[has]
+                order["min"][has] = np.minimum.reduceat(vals, starts)
+                order["max"][has] = np.maximum.reduceat(vals, starts)
+        df = pd.DataFrame({
+            "count": cnt,
+            "mean": mean,
+            "min": order["min"],
+            "max": order["max"],
+            "std": np.sqrt(np.clip(var, 0.0, None)),
+            **{col: order[col] for col in metric_columns(percentiles)[5:]},
+            **evaluate(registered, acc, threshold),
+        })
+        if coverage:
+            df["coverage"] = w
+        out.append(df)
+    return out
+
+def _boundary_summaries(matrix, stack: np.ndarray, nodata=None, threshold=None,
+                        percentiles=PERCENTILES, extras=()) -> list[pd.DataFrame]:
+    # Centre-point and all_touched stats per band from one boundary-class matrix (src.labels.boundary_classes):
+    # the usual (centre-point) columns, the same columns suffixed _all_touched, and boundary_sensitivity,
+    # the all_touched mean minus the centre-point mean (degC).
+    centre = matrix.copy()
+    centre.data = (centre.data == CENTRE).astype(float)
+    centre.eliminate_zeros()
+    touched = matrix.copy()
+    touched.data = np.ones_like(touched.data)
+    out = []
+    for c, t in zip(_sparse_summaries(centre, stack, nodata, threshold, percentiles=percentiles, extras=extras),
+                    _sparse_summaries(touched, stack, nodata, threshold, percentiles=percentiles, extras=extras)):
+        df = pd.concat([c, t.add_suffix("_all_touched")], axis=1)
+        df["boundary_sensitivity"] = df["mean_all_touched"] - df["mean"]
+        out.append(df)
+    return out
+
+# Decoded band shared with pool workers (set by _attach_shared in each worker process).
+_SHARED = {}
+
+def _attach_shared(name: str, shape: tuple, dtype: str, transform, nodata) -> None:
+    shm = shared_memory.SharedMemory(name=name)
+    _SHARED.update(shm=shm, arr=np.ndarray(shape, dtype=dtype, buffer=shm.buf), transform=transform, nodata=nodata)
 
-def compute_zonal_stats(vector: gpd.GeoDataFrame, raster_path: str, band: int = 1, threshold: float | None = None) -> pd.DataFrame:
+def _shared_partition(task: tuple) -> tuple[np.ndarray, list[dict]]:
+    # Worker: stats for one partition of zones, masked against the shared in-memory band (no GeoTIFF reads).
+    idx, geoms, threshold, all_touched, percentiles, extras = task
+    arr, transform, nodata = _SHARED["arr"], _SHARED["transform"], _SHARED["nodata"]
+    rows = []
+    for geom in geoms:
+        win = None if geom is None or geom.is_empty else _zone_window(geom.bounds, transform, *arr.shape)
+        if win is None:
+            rows.append(_zone_summary(np.empty(0), threshold=threshold, percentiles=percentiles, extras=extras))
+            continue
+        (r0, r1), (c0, c1) = win.toranges()
+        sub = arr[r0:r1, c0:c1]
+        inside = geometry_mask([geom], out_shape=sub.shape, transform=window_transform(win, transform),
+                               invert=True, all_touched=all_touched)
+        rows.append(_zone_summary(_masked_values(sub[None], inside, nodata)[0], threshold=threshold,
+                                  percentiles=percentiles, extras=extras))
+    return idx, rows
+
+def _spatial_partitions(vector: gpd.GeoDataFrame, n_parts: int) -> list[np.ndarray]:
+    # Row indices split into contiguous runs of the Hilbert order of zone centres (spatially coherent partitions).
+    b = shapely.bounds(np.asarray(vector["geometry"].values))
+    b = np.where(np.isnan(b), np.nanmin(b, axis=0), b)
+    centres = gpd.GeoSeries(shapely.points((b[:, 0] + b[:, 2]) / 2, (b[:, 1] + b[:, 3]) / 2))
+    order = np.argsort(centres.hilbert_distance().to_numpy(), kind="stable")
+    return [p for p in np.array_split(order, n_parts) if p.size]
+
+def _parallel_window_stats(vector: gpd.GeoDataFrame, src, band: int, threshold, workers: int,
+                           all_touched: bool = False, percentiles=PERCENTILES, extras=()) -> list[dict]:
+    # Decode the band once into shared memory and fan spatial partitions of zones out to a process pool.
+    arr = src.read(band)
+    shm = shared_memory.SharedMemory(create=True, size=max(arr.nbytes, 1))
+    try:
+        np.ndarray(arr.shape, dtype=arr.dtype, buffer=shm.buf)[:] = arr
+        del arr
+        geoms = vector["geometry"].reset_index(drop=True)
+        tasks = [(p, list(geoms.iloc[p]), threshold, all_touched, percentiles, list(extras))
+                 for p in _spatial_partitions(vector, workers * 4)]
+        rows = [None] * len(vector)
+        initargs = (shm.name, (src.height, src.width), src.dtypes[band - 1], src.transform, src.nodata)
+        with ProcessPoolExecutor(max_workers=workers, initializer=_attach_shared, initargs=initargs) as pool:
+            for idx, part in pool.map(_shared_partition, tasks):
+                for i, row in zip(idx, part):
+                    rows[i] = row
+        return rows
+    finally:
+        shm.close()
+        shm.unlink()
+
+# Longest side (pixels) of the grid used by preview=True when the raster has no suitable overview.
+PREVIEW_SIZE = 512
+
+def _preview_factor(src, band: int, preview) -> int:
+    # Decimation factor for a preview: an explicit int, else the smallest overview (or factor) that fits PREVIEW_SIZE.
+    if not isinstance(preview, bool):
+        return max(1, int(preview))
+    need = max(1, math.ceil(max(src.height, src.width) / PREVIEW_SIZE))
+    fits = [f for f in src.overviews(band) if f >= need]
+    return min(fits) if fits else need
+
+def _preview_summary(vector: gpd.GeoDataFrame, src, band: int, threshold, factor: int,
+                     cache_dir: str | None, all_touched: bool = False, percentiles=PERCENTILES,
+                     extras=()) -> pd.DataFrame:
+    # Label-backend stats on a decimated (overview or average-resampled) grid, with per-zone error estimates.
+    h, w = max(1, math.ceil(src.height / factor)), max(1, math.ceil(src.width / factor))
+    arr = src.read(band, out_shape=(h, w), resampling=Resampling.average)
+    transform = src.transform * Affine.scale(src.width / w, src.height / h)
+    labels = zone_labels(vector, transform, (h, w), crs=src.crs, all_touched=all_touched, cache_dir=cache_dir)
+    df = _grouped_summary(arr, labels, len(vector), nodata=src.nodata, threshold=threshold, percentiles=percentiles,
+                          extras=extras)
+    n = df["count"].to_numpy(dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        # Standard error of the mean over coarse pixels, and binomial error of each below-threshold share.
+        df["mean_error"] = np.where(n > 0, df["std"] / np.sqrt(n), np.nan)
+        for col, t in _threshold_columns(threshold):
+            p = df[col].to_numpy() / 100.0
+            df[col + "_error"] = np.where(n > 0, np.sqrt(p * (1 - p) / n) * 100.0, np.nan)
+    # Pixel counts and pixel sums (extensive registered metrics) are scaled to full resolution.
+    scale = (src.width / w) * (src.height / h)
+    df["count"] = np.round(n * scale).astype(int)
+    for m in resolve(extras):
+        if m.extensive:
+            df[m.name] = df[m.name] * scale
+    return df
+
+def _check_all_touched(all_touched, backend: str, coverage: bool, preview: bool | int = False) -> None:
+    # A label grid holds one zone per pixel, so adjacent zones would lose the touched edge pixels they share.
+    if all_touched is True and preview:
+        raise ValueError("all_touched=True is not supported with preview (label grid); use preview=False")
+    if all_touched is True and backend == "label" and not coverage:
+        raise ValueError("all_touched=True needs backend='window' or 'sparse'; a label grid gives each pixel "
+                         "to one zone only")
+
+def compute_zonal_stats(vector: gpd.GeoDataFrame, raster_path: str, band: int = 1, threshold=None,
+                        backend: str = "window", cache_dir: str | None = CACHE_DIR, workers: int = 1,
+                        decoded_cache: str | None = None, preview: bool | int = False,
+                        coverage: bool = False, all_touched: bool | str = False,
+                        percentiles=PERCENTILES, metrics=None) -> pd.DataFrame:
     # Compute zonal stats on a given band of a Tmin raster for each polygon in `vector`.
-    with rasterio.open(raster_path) as src:
+    # backend="window": each polygon window is read and masked once; METRICS and below_threshold_pct come from the same pixels.
+    # backend="label": all polygons are burned into one label grid and every zone is reduced at once (non-overlapping zones).
+    # backend="sparse": a cached zone x pixel CSR matrix; counts, sums and means are sparse matrix products.
+    # The label grid is cached under `cache_dir` keyed by zone geometries and raster grid; None disables the cache.
+    # `threshold` may be a list/range of values: one below_threshold_pct_<t> column per value from the same read.
+    # workers > 1 (window backend) decodes the band once into shared memory and splits zones across processes.
+    # decoded_cache: directory (e.g. CACHE_DIR) where bands are decoded once and memory-mapped on later runs.
+    # preview=True (or a decimation factor) computes approximate stats from an overview level for a fast first paint;
+    # count is scaled to full resolution, std/percentiles describe the coarse pixels, and mean_error plus
+    # <below column>_error give per-zone standard errors. Zones smaller than a coarse pixel may come back empty.
+    # coverage=True weights every pixel by the exact fraction of it inside the zone (cached per zone layer and grid,
+    # sparse backend), so districts smaller than a pixel still get values; adds a `coverage` column (pixel area).
+    # all_touched=True counts every pixel a polygon touches (as in notebooks/estimation.ipynb) instead of pixel
+    # centres (window and sparse backends only: shared edge pixels count for every zone); all_touched="both"
+    # classifies each zone's pixels once into centre/edge-only cells and returns the centre-point columns, their
+    # *_all_touched counterparts and boundary_sensitivity (mean difference, degC).
+    # percentiles: exact percentiles to report (default 10 and 90), one percentile_<q> column each; the label and
+    # sparse backends read all of them from one (zone, value) sort of the band's pixels.
+    # metrics: the metric columns to return (see metric_plan), e.g. ["mean"] or ["count", "mean", "percentile_10"];
+    # percentile_<q> entries replace `percentiles`, and mean-only requests skip the sort entirely; names from
+    # src.metrics.REGISTRY (e.g. "frost_degree_sum", "cold_spell_intensity") add those metrics to the same pass.
+    columns, percentiles, extras = metric_plan(metrics, percentiles)
+    if backend not in ("window", "label", "sparse"):
+        raise ValueError("backend must be one of: window, label, sparse")
+    if all_touched not in (False, True, "both"):
+        raise ValueError("all_touched must be one of: False, True, both")
+    _check_all_touched(all_touched, backend, coverage, preview)
+    with open_raster(raster_path, decoded_cache) as src:
         nodata = src.nodata
+        if all_touched == "both":
+            matrix = zone_matrix(vector, src.transform, (src.height, src.width), crs=src.crs,
+                                 cache_dir=cache_dir, kind="boundary")
+            df = _boundary_summaries(matrix, src.read([band]), nodata=nodata, threshold=threshold,
+                                     percentiles=percentiles, extras=extras)[0]
+        elif preview:
+            df = _preview_summary(vector, src, band, threshold, _preview_factor(src, band, preview), cache_dir,
+                                  all_touched=all_touched, percentiles=percentiles, extras=extras)
+        elif backend == "sparse" or coverage:
+            matrix = zone_matrix(vector, src.transform, (src.height, src.width), crs=src.crs,
+                                 all_touched=all_touched, cache_dir=cache_dir,
+                                 kind="coverage" if coverage else "labels")
+            df = _sparse_summaries(matrix, src.read([band]), nodata=nodata, threshold=threshold,
+                                   coverage=coverage, percentiles=percentiles, metrics=columns, extras=extras)[0]
+        elif backend == "label":
+            labels = zone_labels(vector, src.transform, (src.height, src.width), crs=src.crs,
+                                 all_touched=all_touched, cache_dir=cache_dir)
+            df = _grouped_summary(src.read(band), labels, len(vector), nodata=nodata, threshold=threshold,
+                                  percentiles=percentiles, extras=extras)
+        else:
+            if workers > 1 and len(vector) > 1:
+                rows = _parallel_window_stats(vector, src, band, threshold, workers, all_touched=all_touched,
+                                              percentiles=percentiles, extras=extras)
+            else:
+                rows = [_zone_summary(_zone_values(src, geom, [band], nodata, all_touched=all_touched)[0],
+                                      threshold=threshold, percentiles=percentiles, extras=extras)
+                        for geom in vector["geometry"]]
+            df = pd.DataFrame(rows, columns=list(_zone_summary(np.empty(0), threshold, percentiles, extras)))
+    return _select_metrics(df, columns)
 
-    zs = zonal_stats(
-        vectors=vector["geometry"],
-        raster=raster_path,
-        band=band,
-        nodata=nodata,
-        stats=METRICS,
-        geojson_out=False,
-        raster_out=False,
-        all_touched=False
-    )
-    df = pd.DataFrame(zs)
-
-    # Second pass to get custom metric using mini raster arrays
-    zs_r = zonal_stats(
-        vectors=vector["geometry"],
-        raster=raster_path,
-        band=band,
-        nodata=nodata,
-        stats=None,
-        raster_out=True,
-        all_touched=False
-    )
-    bt_list = []
-    for item in zs_r:
-        arr = item.get("mini_raster_array")
-        if arr is None:
-            bt_list.append(np.nan)
-            continue
-        a = arr.astype(float)
-        if nodata is not None:
-            a[a == nodata] = np.nan
-        bt_list.append(_custom_metrics(a, nodata=nodata, threshold=threshold)["below_threshold_pct"])
-    df["below_threshold_pct"] = bt_list
+def compute_zonal_cube(vector: gpd.GeoDataFrame, raster_path: str, bands: list[int] | None = None,
+                       threshold=None, backend: str = "window",
+                       cache_dir: str | None = CACHE_DIR, decoded_cache: str | None = None,
+                       coverage: bool = False, all_touched: bool = False,
+                       percentiles=PERCENTILES) -> xr.DataArray:
+    # Zonal stats for several bands at once (default: all), as a zone x band x metric DataArray.
+    # The band stack is read once (per polygon window, or whole for the label backend); slice with cube_band_frame.
+    # backend="sparse" reduces the whole stack at once: counts/sums/means of all bands are one matrix product each.
+    # coverage=True uses exact coverage-fraction weights (see compute_zonal_stats), computed once for all bands.
+    # all_touched=True counts every touched pixel instead of pixel centres; percentiles as in compute_zonal_stats.
+    if backend not in ("window", "label", "sparse"):
+        raise ValueError("backend must be one of: window, label, sparse")
+    _check_all_touched(all_touched, backend, coverage)
+    _, percentiles, _ = metric_plan(None, percentiles)
+    columns = metric_columns(percentiles) + [col for col, _ in _threshold_columns(threshold)]
+    columns += ["coverage"] if coverage else []
+    with open_raster(raster_path, decoded_cache) as src:
+        nodata = src.nodata
+        bands = list(bands) if bands is not None else list(range(1, src.count + 1))
+        cube = np.full((len(vector), len(bands), len(columns)), np.nan)
+        if backend == "sparse" or coverage:
+            matrix = zone_matrix(vector, src.transform, (src.height, src.width), crs=src.crs,
+                                 all_touched=all_touched, cache_dir=cache_dir,
+                                 kind="coverage" if coverage else "labels")
+            summaries = _sparse_summaries(matrix, src.read(bands), nodata=nodata, threshold=threshold,
+                                          coverage=coverage, percentiles=percentiles)
+            for j, df in enumerate(summaries):
+                cube[:, j, :] = df[columns].to_numpy(dtype=float)
+        elif backend == "label":
+            labels = zone_labels(vector, src.transform, (src.height, src.width), crs=src.crs,
+                                 all_touched=all_touched, cache_dir=cache_dir)
+            for j, b in enumerate(bands):
+                df = _grouped_summary(src.read(b), labels, len(vector), nodata=nodata, threshold=threshold,
+                                      percentiles=percentiles)
+                cube[:, j, :] = df[columns].to_numpy(dtype=float)
+        else:
+            for i, geom in enumerate(vector["geometry"]):
+                for j, data in enumerate(_zone_values(src, geom, bands, nodata, all_touched=all_touched)):
+                    row = _zone_summary(data, threshold=threshold, percentiles=percentiles)
+                    cube[i, j, :] = [row[c] for c in columns]
+
+    coords = {"zone": np.arange(len(vector)), "band": bands, "metric": columns}
+    if "UBIGEO" in vector.columns:
+        coords["UBIGEO"] = ("zone", vector["UBIGEO"].to_numpy())
+    return xr.DataArray(cube, dims=("zone", "band", "metric"), coords=coords, name="tmin_zonal",
+                        attrs={"raster": raster_path})
+
+def compute_zonal_histograms(vector: gpd.GeoDataFrame, raster_path: str, bands: list[int] | None = None,
+                             backend: str = "window", cache_dir: str | None = CACHE_DIR,
+                             decoded_cache: str | None = None) -> xr.DataArray:
+    # Per-zone Tmin histograms on the fixed src.histogram grid, as a zone x band x bin (uint32) DataArray.
+    # Percentiles and threshold fractions then come from src.histogram without rereading the raster,
+    # and zone histograms can be summed (merge_histograms) into provinces or departments.
+    if backend not in ("window", "label"):
+        raise ValueError("backend must be one of: window, label")
+    with open_raster(raster_path, decoded_cache) as src:
+        nodata = src.nodata
+        bands = list(bands) if bands is not None else list(range(1, src.count + 1))
+        hist = np.zeros((len(vector), len(bands), histogram.n_bins()), dtype=np.uint32)
+        if backend == "label":
+            labels = zone_labels(vector, src.transform, (src.height, src.width), crs=src.crs,
+                                 all_touched=False, cache_dir=cache_dir)
+            for j, b in enumerate(bands):
+                lab, vals = _label_pixels(src.read(b), labels, nodata)
+                hist[:, j, :] = histogram.zone_histograms(vals, lab, len(vector))
+        else:
+            for i, geom in enumerate(vector["geometry"]):
+                for j, data in enumerate(_zone_values(src, geom, bands, nodata, all_touched=False)):
+                    hist[i, j, :] = histogram.zone_histograms(data, np.zeros(data.size, dtype=np.int64), 1)[0]
+
+    coords = {"zone": np.arange(len(vector)), "band": bands, "bin": histogram.bin_edges()[:-1]}
+    if "UBIGEO" in vector.columns:
+        coords["UBIGEO"] = ("zone", vector["UBIGEO"].to_numpy())
+    return xr.DataArray(hist, dims=("zone", "band", "bin"), coords=coords, name="tmin_histogram",
+                        attrs={"raster": raster_path, "bin_lo": histogram.BIN_LO, "bin_width": histogram.BIN_WIDTH})
+
+SUFFICIENT_STATS = ["count", "sum", "sumsq", "min", "max"]
+
+def _sufficient_arrays(vals: np.ndarray, lab: np.ndarray, n_zones: int) -> dict:
+    # Mergeable per-zone accumulators: count, sum, sum of squares, min, max and the fixed-grid histogram.
+    vmin = np.full(n_zones, np.inf)
+    vmax = np.full(n_zones, -np.inf)
+    np.minimum.at(vmin, lab, vals)
+    np.maximum.at(vmax, lab, vals)
+    return {
+        "count": np.bincount(lab, minlength=n_zones),
+        "sum": np.bincount(lab, weights=vals, minlength=n_zones),
+        "sumsq": np.bincount(lab, weights=vals * vals, minlength=n_zones),
+        "min": vmin,
+        "max": vmax,
+        "hist": histogram.zone_histograms(vals, lab, n_zones),
+    }
+
+def compute_zonal_sufficient(vector: gpd.GeoDataFrame, raster_path: str, bands: list[int] | None = None,
+                             backend: str = "window", cache_dir: str | None = CACHE_DIR,
+                             decoded_cache: str | None = None, sketch_k: int | None = None) -> xr.Dataset:
+    # Sufficient statistics per zone and band (see SUFFICIENT_STATS, plus `hist`), read once from the band stack.
+    # They sum across zones (src.rollup) and finalize with sufficient_frame, so coarser levels need no second pass.
+    # sketch_k adds a mergeable KLL quantile sketch per zone and band (`sketch`, object dtype) for percentiles.
+    if backend not in ("window", "label"):
+        raise ValueError("backend must be one of: window, label")
+    n = len(vector)
+    with open_raster(raster_path, decoded_cache) as src:
+        nodata = src.nodata
+        bands = list(bands) if bands is not None else list(range(1, src.count + 1))
+        acc = {k: np.zeros((n, len(bands))) for k in SUFFICIENT_STATS}
+        acc["count"] = np.zeros((n, len(bands)), dtype=np.int64)
+        acc["hist"] = np.zeros((n, len(bands), histogram.n_bins()), dtype=np.uint32)
+        if sketch_k:
+            acc["sketch"] = sketch.new_sketches(n * len(bands), sketch_k).reshape(n, len(bands))
+        if backend == "label":
+            labels = zone_labels(vector, src.transform, (src.height, src.width), crs=src.crs,
+                                 all_touched=False, cache_dir=cache_dir)
+            for j, b in enumerate(bands):
+                arr = src.read(b)
+                for k, v in kernels.zone_moments(arr, labels, n, nodata=nodata).items():
+                    if k in acc:
+                        acc[k][:, j] = v
+                lab, vals = _label_pixels(arr, labels, nodata)
+                acc["hist"][:, j] = histogram.zone_histograms(vals, lab, n)
+                if sketch_k:
+                    sketch.update_zone_sketches(acc["sketch"][:, j], vals, lab)
+        else:
+            for i, geom in enumerate(vector["geometry"]):
+                for j, data in enumerate(_zone_values(src, geom, bands, nodata, all_touched=False)):
+                    for k, v in _sufficient_arrays(data, np.zeros(data.size, dtype=np.int64), 1).items():
+                        acc[k][i, j] = v[0]
+                    if sketch_k:
+                        acc["sketch"][i, j].update(data)
+
+    coords = {"zone": np.arange(n), "band": bands, "bin": histogram.bin_edges()[:-1]}
+    if "UBIGEO" in vector.columns:
+        coords["UBIGEO"] = ("zone", vector["UBIGEO"].to_numpy())
+    data_vars = {k: (("zone", "band"), acc[k]) for k in SUFFICIENT_STATS}
+    data_vars["hist"] = (("zone", "band", "bin"), acc["hist"])
+    if sketch_k:
+        data_vars["sketch"] = (("zone", "band"), acc["sketch"])
+    return xr.Dataset(data_vars, coords=coords,
+                      attrs={"raster": raster_path, "bin_lo": histogram.BIN_LO, "bin_width": histogram.BIN_WIDTH})
+
+def sufficient_frame(ds: xr.Dataset, band: int, threshold=None, percentiles=PERCENTILES,
+                     metrics=None) -> pd.DataFrame:
+    # Standard metrics (one column per value of `percentiles`) plus below-threshold column(s) for one band of a
+    # sufficient-statistics Dataset; `metrics` restricts the columns as in compute_zonal_stats.
+    # count/mean/min/max/std are exact; percentiles and off-grid thresholds are within one histogram bin
+    # (percentiles come from the KLL sketches instead when the Dataset carries them).
+    b = ds.sel(band=band)
+    counts = b["count"].values.astype(np.int64)
+    has = counts > 0
+    hist = b["hist"].values
+    lo, width = ds.attrs["bin_lo"], ds.attrs["bin_width"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = np.where(has, b["sum"].values / counts, np.nan)
+        var = np.where(has, b["sumsq"].values / counts - mean ** 2, np.nan)
+    columns, percentiles, extras = metric_plan(metrics, percentiles)
+    if extras:
+        raise ValueError(f"{', '.join(extras)} need the zone pixels; use compute_zonal_stats for them")
+    if not percentiles:
+        pct = np.empty((counts.size, 0))
+    elif "sketch" in ds:
+        pct = sketch.sketch_percentiles(b["sketch"].values, list(percentiles))
+    else:
+        pct = histogram.hist_percentile(hist, list(percentiles), lo=lo, width=width)
+    df = pd.DataFrame({
+        "count": counts,
+        "mean": mean,
+        "min": np.where(has, b["min"].values, np.nan),
+        "max": np.where(has, b["max"].values, np.nan),
+        "std": np.sqrt(np.clip(var, 0.0, None)),
+        **{percentile_column(q): pct[:, j] for j, q in enumerate(percentiles)},
+    })
+    for col, t in _threshold_columns(threshold):
+        df[col] = np.nan if t is None else histogram.hist_below_pct(hist, t, lo=lo, width=width)
+    return _select_metrics(df, columns)
+
+def cube_band_frame(cube: xr.DataArray, band: int) -> pd.DataFrame:
+    # One band of a zonal cube as the DataFrame compute_zonal_stats would return for it.
+    df = pd.DataFrame(cube.sel(band=band).values, columns=list(cube["metric"].values))
+    df["count"] = df["count"].astype(int)
     return df
 
+def select_threshold(stats_df: pd.DataFrame, threshold: float) -> pd.DataFrame:
+    # Pick one threshold of a sweep as below_threshold_pct, dropping the other sweep columns.
+    col = threshold_column(threshold)
+    if col not in stats_df.columns:
+        raise KeyError(f"threshold {threshold:g} is not part of the computed sweep")
+    out = stats_df[[c for c in stats_df.columns if not c.startswith("below_threshold_pct")]].copy()
+    out["below_threshold_pct"] = stats_df[col]
+    return out
+
 def attach_index(vector: gpd.GeoDataFrame, stats_df: pd.DataFrame, level: str) -> pd.DataFrame:
     meta_cols = []
     if "DEPARTAMENTO" in vector.columns: meta_cols.append("DEPARTAMENTO")
@@ -0,0 +1,39 @@
+import numpy as np
+import geopandas as gpd
+import pytest
+import rasterio
+import shapely
+from rasterio.transform import from_origin
+
+# Synthetic Tmin raster (3 bands, float32, -9999 nodata) and a Voronoi tessellation of districts whose shared
+# edges cut through pixels, so centre-point and all_touched rules both matter.
+HEIGHT, WIDTH, RES = 48, 64, 1000.0
+ORIGIN = (500000.0, 8500000.0)
+CRS = "EPSG:32718"
+
+@pytest.fixture(scope="session")
+def synthetic(tmp_path_factory):
+    folder = tmp_path_factory.mktemp("synthetic")
+    rng = np.random.default_rng(42)
+    rows, cols = np.mgrid[0:HEIGHT, 0:WIDTH]
+    data = np.stack([(5.0 + 0.2 * rows - 0.1 * cols + b + rng.normal(0, 2.0, (HEIGHT, WIDTH))) for b in range(3)])
+    data = data.astype("float32")
+    data[:, rng.random((HEIGHT, WIDTH)) < 0.03] = -9999.0
+    path = str(folder / "tmin.tif")
+    transform = from_origin(ORIGIN[0], ORIGIN[1], RES, RES)
+    with rasterio.open(path, "w", driver="GTiff", height=HEIGHT, width=WIDTH, count=3, dtype="float32",
+                       crs=CRS, transform=transform, nodata=-9999.0) as dst:
+        dst.write(data)
+
+    x0, y1 = ORIGIN
+    x1, y0 = x0 + WIDTH * RES, y1 - HEIGHT * RES
+    extent = shapely.box(x0 + 0.3 * RES, y0 + 0.3 * RES, x1 - 0.3 * RES, y1 - 0.3 * RES)
+    points = shapely.multipoints(np.column_stack([rng.uniform(x0, x1, 30), rng.uniform(y0, y1, 30)]))
+    cells = [c.intersection(extent) for c in shapely.get_parts(shapely.voronoi_polygons(points, extend_to=extent))]
+    gdf = gpd.GeoDataFrame(geometry=[c for c in cells if not c.is_empty], crs=CRS)
+    n = len(gdf)
+    gdf["DEPARTAMENTO"] = [f"D{i % 3}" for i in range(n)]
+    gdf["PROVINCIA_N"] = [f"P{i % 6}" for i in range(n)]
+    gdf["DISTRITO_N"] = [f"X{i}" for i in range(n)]
+    gdf["UBIGEO"] = [f"{i % 3:02d}{i % 6:02d}{i:02d}" for i in range(n)]
+    return path, gdf
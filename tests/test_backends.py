@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+from rasterstats import zonal_stats
+from src.rollup import level_keys, rollup_level
+from src.streaming import stream_zonal_stats
+from src.zonal_stats import (METRICS, compute_zonal_cube, compute_zonal_stats, compute_zonal_sufficient,
+                             sufficient_frame)
+
+# Every engine against the rasterstats output it replaced (centre-point rule, nodata masked, linear percentiles).
+# Histogram-based percentiles (sufficient statistics, streaming) are allowed one 0.05 degC bin.
+BIN = 0.05
+
+def _rasterstats(geoms, path, band):
+    return pd.DataFrame(list(zonal_stats(geoms, path, band=band, stats=METRICS)))[METRICS].to_numpy(float)
+
+def _check(got, expected, pct_tol=1e-4):
+    got = got[METRICS].to_numpy(float)
+    np.testing.assert_allclose(got[:, :5], expected[:, :5], atol=1e-4)
+    np.testing.assert_allclose(got[:, 5:], expected[:, 5:], atol=pct_tol)
+
+@pytest.mark.parametrize("kwargs", [dict(backend="window"), dict(backend="label"), dict(backend="sparse"),
+                                    dict(backend="window", workers=2)], ids=["window", "label", "sparse", "workers"])
+def test_compute_zonal_stats_matches_rasterstats(synthetic, kwargs):
+    path, gdf = synthetic
+    _check(compute_zonal_stats(gdf, path, 2, 0.0, cache_dir=None, **kwargs), _rasterstats(gdf, path, 2))
+
+@pytest.mark.parametrize("backend", ["window", "label", "sparse"])
+def test_cube_matches_rasterstats(synthetic, backend):
+    path, gdf = synthetic
+    cube = compute_zonal_cube(gdf, path, backend=backend, cache_dir=None)
+    for band in (1, 3):
+        got = pd.DataFrame(cube.sel(band=band, metric=METRICS).values, columns=METRICS)
+        _check(got, _rasterstats(gdf, path, band))
+
+def test_streaming_matches_rasterstats(synthetic):
+    path, gdf = synthetic
+    _check(stream_zonal_stats(gdf, path, 2, 0.0, memory_mb=0.05), _rasterstats(gdf, path, 2), pct_tol=BIN)
+
+@pytest.mark.parametrize("backend", ["window", "label"])
+def test_sufficient_and_rollup_match_rasterstats(synthetic, backend):
+    path, gdf = synthetic
+    ds = compute_zonal_sufficient(gdf, path, backend=backend, cache_dir=None)
+    _check(sufficient_frame(ds, 2), _rasterstats(gdf, path, 2), pct_tol=BIN)
+    _, rolled = rollup_level(gdf, ds, "province")
+    provinces = gdf.assign(_key=level_keys(gdf, "province")).dissolve(by="_key").sort_index()
+    _check(sufficient_frame(rolled, 2), _rasterstats(provinces, path, 2), pct_tol=BIN)
@@ -0,0 +1,19 @@
+import shutil
+from src import cog
+
+def test_failed_conversion_is_not_retried(synthetic, tmp_path, monkeypatch):
+    path = str(tmp_path / "upload.tif")
+    shutil.copy(synthetic[0], path)
+    calls = []
+
+    def broken(raster_path, dst_path=None):
+        calls.append(raster_path)
+        raise RuntimeError("no space left")
+
+    monkeypatch.setattr(cog, "convert_to_cog", broken)
+    assert cog.ensure_cog(path) == path
+    cog._JOBS[path].exception()  # wait for the background job
+    for _ in range(3):
+        assert cog.ensure_cog(path) == path
+    assert calls == [path]
+    assert isinstance(cog.conversion_error(path), RuntimeError)
@@ -0,0 +1,15 @@
+import numpy as np
+import pytest
+from src import kernels
+
+ENGINES = [e for e in kernels.ENGINES if e != "numba" or kernels.numba is not None]
+
+@pytest.mark.parametrize("engine", ENGINES)
+def test_float32_nodata_is_masked(engine):
+    arr = np.array([[1.0, -9999.9], [2.0, 3.0]], dtype="float32")
+    labels = np.array([[1, 1], [1, 0]], dtype="int32")
+    out = kernels.zone_moments(arr, labels, 1, nodata=-9999.9, thresholds=[1.5], engine=engine)
+    assert out["count"][0] == 2
+    assert out["sum"][0] == 3.0
+    assert out["min"][0] == 1.0
+    assert out["below"][0, 0] == 1
@@ -0,0 +1,43 @@
+import os
+import shutil
+from src.raster_cache import DatasetPool, evict_decoded, open_raster
+
+RASTER = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "tmin_raster.tif")
+
+def _decode(path, cache_dir):
+    with open_raster(path, cache_dir) as src:
+        src.read(1)
+        return src.folder
+
+def test_decoded_cache_drops_deleted_sources_and_shares_cog_copy(tmp_path):
+    cache = str(tmp_path / "cache")
+    a, b = str(tmp_path / "a.tif"), str(tmp_path / "b.tif")
+    shutil.copy(RASTER, a)
+    shutil.copy(RASTER, b)
+    folder_a = _decode(a, cache)
+    shutil.copy(a, str(tmp_path / "a.cog.tif"))
+    assert _decode(str(tmp_path / "a.cog.tif"), cache) == folder_a
+    folder_b = _decode(b, cache)
+    os.remove(a)
+    assert evict_decoded(cache) == [folder_a]
+    assert evict_decoded(cache, 0, keep=(folder_b,)) == []
+    assert evict_decoded(cache, 0) == [folder_b]
+
+def _open_fds(path):
+    fd_dir = "/proc/self/fd"
+    return sum(os.path.realpath(os.path.join(fd_dir, fd)).startswith(path) for fd in os.listdir(fd_dir))
+
+def test_pool_caps_rasters_and_closes_deleted_files(tmp_path):
+    pool = DatasetPool(per_raster=2, max_rasters=2)
+    paths = [str(tmp_path / f"r{i}.tif") for i in range(3)]
+    for p in paths:
+        shutil.copy(RASTER, p)
+        with pool.borrow(p) as src:
+            src.read(1, window=((0, 1), (0, 1)))
+    assert len(pool._idle) == 2
+    assert os.path.abspath(paths[0]) not in {k[0] for k in pool._idle}
+    os.remove(paths[2])
+    assert pool.prune() == 1
+    if os.path.isdir("/proc/self/fd"):
+        assert _open_fds(paths[2]) == 0
+    pool.close()
@@ -0,0 +1,18 @@
+import numpy as np
+from src.sketch import KLLSketch
+
+def test_merged_partial_sketches_stay_within_rank_error():
+    data = np.random.default_rng(7).normal(size=200_000)
+    merged = KLLSketch(200)
+    for part in np.array_split(data, 100):
+        merged = merged + KLLSketch(200).update(part)
+    qs = np.linspace(0.01, 0.99, 99)
+    ranks = np.searchsorted(np.sort(data), merged.quantile(qs)) / data.size
+    assert merged.n == data.size
+    assert np.abs(ranks - qs).max() < 0.0165
+
+def test_seeded_sketch_is_reproducible():
+    data = np.random.default_rng(1).normal(size=50_000)
+    a = KLLSketch(50, seed=3).update(data).quantile([0.1, 0.9])
+    b = KLLSketch(50, seed=3).update(data).quantile([0.1, 0.9])
+    assert np.array_equal(a, b)
@@ -0,0 +1,12 @@
+import pandas as pd
+from src.store import load_results, read_results, risk_counts, write_results
+
+def test_results_are_keyed_by_zone_layer(tmp_path):
+    full = pd.DataFrame({"UBIGEO": ["010101", "010102"], "mean": [1.0, 2.0], "below_threshold_pct": [50.0, 0.0]})
+    write_results(full, "r1", "layerA", "district", 1, 0.0, store_dir=str(tmp_path))
+    assert read_results("r1", "layerB", "district", 1, 0.0, store_dir=str(tmp_path)) is None
+    write_results(full.iloc[:1], "r1", "layerB", "district", 1, 0.0, store_dir=str(tmp_path))
+    assert len(read_results("r1", "layerB", "district", 1, 0.0, store_dir=str(tmp_path))) == 1
+    assert len(load_results("r1", zones_hash="layerA", store_dir=str(tmp_path))) == 2
+    counts = risk_counts(10.0, 0.0, raster_hash="r1", store_dir=str(tmp_path))
+    assert sorted(counts["layer"]) == ["layerA", "layerB"]
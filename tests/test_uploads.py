@@ -0,0 +1,21 @@
+import os
+from src.uploads import evict_uploads
+
+def _write(folder, name, size, mtime):
+    path = os.path.join(folder, name)
+    with open(path, "wb") as f:
+        f.write(b"x" * size)
+    os.utime(path, (mtime, mtime))
+    return path
+
+def test_evict_keeps_active_upload_cog_and_conversions(tmp_path):
+    d = str(tmp_path)
+    old = _write(d, "aaa.tif", 100, 1)
+    old_cog = _write(d, "aaa.cog.tif", 100, 2)
+    busy = _write(d, "bbb.tif", 100, 3)
+    tmp = _write(d, "bbb.cog.tif.123.tmp.tif", 100, 4)
+    active = _write(d, "ccc.tif", 100, 5)
+    active_cog = _write(d, "ccc.cog.tif", 100, 6)
+    removed = evict_uploads(d, 1, keep=(active,))
+    assert sorted(removed) == sorted([old, old_cog])
+    assert all(os.path.exists(p) for p in (busy, tmp, active, active_cog))
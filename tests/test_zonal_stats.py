@@ -0,0 +1,75 @@
+import numpy as np
+import pandas as pd
+import pytest
+from rasterstats import zonal_stats
+from src.metrics import REGISTRY, register
+from src.zonal_stats import (METRICS, _segment_weighted_percentile, compute_zonal_cube, compute_zonal_stats,
+                             compute_zonal_sufficient, sufficient_frame)
+
+def weighted_percentile(values, weights, q):
+    # One-segment call of _segment_weighted_percentile.
+    return _segment_weighted_percentile(np.asarray(values, dtype=float), np.asarray(weights, dtype=float),
+                                        np.array([0]), np.array([len(values)]), q)[0]
+
+def test_weighted_percentile_skewed_weights_move_median():
+    assert weighted_percentile([1.0, 10.0], [1.0, 1.0], 50) == 5.5
+    assert weighted_percentile([1.0, 10.0], [1.0, 0.01], 50) < 1.5
+    assert weighted_percentile([1.0, 10.0], [0.01, 1.0], 50) > 9.5
+
+def test_weighted_percentile_counts_weight_of_largest_value():
+    full = weighted_percentile([1.0, 2.0, 10.0], [1.0, 1.0, 1.0], 90)
+    sliver = weighted_percentile([1.0, 2.0, 10.0], [1.0, 1.0, 0.01], 90)
+    assert sliver < full
+
+def test_weighted_percentile_segments():
+    vals = np.array([1.0, 10.0, 3.0, 4.0, 5.0])
+    w = np.array([1.0, 0.01, 1.0, 1.0, 1.0])
+    out = _segment_weighted_percentile(vals, w, np.array([0, 2, 5]), np.array([2, 3, 0]), 50)
+    assert out[1] == 4.0
+    assert np.isnan(out[2])
+
+def test_all_touched_matches_rasterstats_on_adjacent_zones(synthetic):
+    path, gdf = synthetic
+    expected = pd.DataFrame(zonal_stats(gdf, path, band=2, stats=METRICS, all_touched=True))
+    for backend in ("window", "sparse"):
+        got = compute_zonal_stats(gdf, path, 2, backend=backend, all_touched=True, cache_dir=None)
+        np.testing.assert_allclose(got[METRICS].to_numpy(float), expected[METRICS].to_numpy(float), atol=1e-4)
+    cube = compute_zonal_cube(gdf, path, bands=[2], backend="sparse", all_touched=True, cache_dir=None)
+    np.testing.assert_allclose(cube.sel(band=2, metric=METRICS).values, expected[METRICS].to_numpy(float), atol=1e-4)
+
+def test_all_touched_rejects_label_grids(synthetic):
+    path, gdf = synthetic
+    with pytest.raises(ValueError):
+        compute_zonal_stats(gdf, path, 2, backend="label", all_touched=True, cache_dir=None)
+    with pytest.raises(ValueError):
+        compute_zonal_stats(gdf, path, 2, preview=True, all_touched=True, cache_dir=None)
+    with pytest.raises(ValueError):
+        compute_zonal_cube(gdf, path, backend="label", all_touched=True, cache_dir=None)
+
+@pytest.mark.parametrize("q", [-10, 150])
+def test_out_of_range_percentiles_are_rejected(synthetic, q):
+    path, gdf = synthetic
+    for backend in ("window", "label", "sparse"):
+        with pytest.raises(ValueError, match="between 0 and 100"):
+            compute_zonal_stats(gdf, path, 1, backend=backend, percentiles=[q], cache_dir=None)
+        with pytest.raises(ValueError, match="between 0 and 100"):
+            compute_zonal_stats(gdf, path, 1, backend=backend, metrics=["mean", f"percentile_{q}"], cache_dir=None)
+    with pytest.raises(ValueError, match="between 0 and 100"):
+        compute_zonal_cube(gdf, path, percentiles=[q], cache_dir=None)
+    ds = compute_zonal_sufficient(gdf, path, backend="label", cache_dir=None)
+    with pytest.raises(ValueError, match="between 0 and 100"):
+        sufficient_frame(ds, 1, percentiles=[q])
+
+def test_preview_scales_extensive_metrics_like_count(synthetic):
+    path, gdf = synthetic
+    register("pixels", terms={"one": np.ones_like}, extensive=True)(
+        lambda acc, threshold: {"pixels": acc["terms"]["one"]})
+    try:
+        full = compute_zonal_stats(gdf, path, 1, backend="label", metrics=["count", "pixels"], cache_dir=None)
+        preview = compute_zonal_stats(gdf, path, 1, backend="label", preview=4, metrics=["count", "pixels"],
+                                      cache_dir=None)
+    finally:
+        REGISTRY.pop("pixels")
+    np.testing.assert_allclose(full["pixels"], full["count"])
+    np.testing.assert_allclose(preview["pixels"], preview["count"], atol=0.5)
+    assert abs(preview["pixels"].sum() / full["pixels"].sum() - 1) < 0.1